@@ -25,6 +25,7 @@
         'data/email_templates.xml',
         'data/ir_cron.xml',
         'data/shopping_cart_cron.xml',
+        'views/product_cost_history_views.xml',
         'views/product_template_views.xml',
         'views/project_client_views.xml',
         'views/price_authorization_views.xml',
@@ -4,12 +4,20 @@ from . import shopping_cart
 from . import sale_order
 from . import stock_lot_hold_order
 from . import stock_quant
+from . import stock_location
 from . import product_template
 from . import price_authorization
 from . import stock_picking
 from . import ir_actions_report
 from . import product_category_pricing
 from . import banorte_rate_log
+from . import res_currency_rate
+from . import resource_calendar_leaves
+from . import freight_tariff
+from . import freight_national_route
+from . import purchase_order_line
+from . import product_cost_history
+from . import product_price_ladder
 from . import project_client
 from . import ptt_channel
 from . import ptt_presence
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class FreightNationalRoute(models.Model):
+    _inherit = 'freight.national.route'
+
+    # Campos de la ruta nacional que entran en el costeo ALL-IN (costo del
+    # viaje / capacidad). Una ruta nueva todavía no tiene productos: el
+    # vínculo producto → ruta ya dispara el costeo desde el propio producto.
+    _SOM_COSTING_FIELDS = ('costo', 'capacidad', 'active')
+
+    def _som_queue_dependent_costing(self):
+        self.env['product.template']._som_queue_costing_for_national_routes(self)
+
+    def write(self, vals):
+        res = super().write(vals)
+        if any(f in vals for f in self._SOM_COSTING_FIELDS):
+            self._som_queue_dependent_costing()
+        return res
+
+    def unlink(self):
+        # Antes del super(): después el M2O de los productos ya quedó vacío
+        # y no habría forma de encontrarlos.
+        self._som_queue_dependent_costing()
+        return super().unlink()
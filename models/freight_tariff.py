@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+
+class FreightTariff(models.Model):
+    _inherit = 'freight.tariff'
+
+    # Campos de la tarifa que entran en el costeo ALL-IN: si cambian, se
+    # encolan SOLO los productos de las rutas afectadas (antes y después
+    # del cambio, por si la tarifa se movió de ruta).
+    _SOM_COSTING_FIELDS = (
+        'all_in', 'state', 'country_id', 'pol_id', 'pod_id',
+        'naviera_id', 'forwarder_id',
+    )
+
+    def _som_queue_dependent_costing(self):
+        self.env['product.template']._som_costing_dependents_of_tariffs(
+            self
+        )._som_queue_costing_recompute()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._som_queue_dependent_costing()
+        return records
+
+    def write(self, vals):
+        relevant = any(f in vals for f in self._SOM_COSTING_FIELDS)
+        if relevant:
+            self._som_queue_dependent_costing()
+        res = super().write(vals)
+        if relevant:
+            self._som_queue_dependent_costing()
+        return res
+
+    def unlink(self):
+        self._som_queue_dependent_costing()
+        return super().unlink()
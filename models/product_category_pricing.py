@@ -103,11 +103,11 @@ class ProductCategoryPricing(models.Model):
         if self.pricing_mode == 'fixed':
             vals['x_fixed_price'] = self.x_fixed_price
 
-        products.write(vals)
-
-        # Forzar recálculo
-        products._compute_costo_all_in()
-        products._calculate_escalera_precios()
+        # El write solo ENCOLA el recálculo (los campos ya son disparadores);
+        # la cola se vacía una vez: cada producto se calcula exactamente una
+        # vez, y las categorías grandes se van al cron de la cola diferida.
+        products.with_context(som_costing_defer=True).write(vals)
+        products._som_flush_costing_queue()
 
         return {
             'type': 'ir.actions.client',
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import defaultdict
+
+from markupsafe import Markup
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class ProductCostHistory(models.Model):
+    """Histórico NUMÉRICO del costo ALL-IN: una fila por cambio real (>= 1
+    centavo), insertada por lote desde _compute_costo_all_in. Sustituye a
+    los mensajes de chatter por cambio; el chatter recibe solo un resumen
+    diario (_cron_post_cost_history_digest)."""
+    _name = 'product.cost.history'
+    _description = 'Histórico de costo ALL-IN'
+    _order = 'date desc, id desc'
+
+    product_tmpl_id = fields.Many2one(
+        'product.template', string='Producto', required=True, ondelete='cascade',
+    )
+    date = fields.Datetime(string='Fecha', required=True, default=fields.Datetime.now)
+    old_cost_mxn = fields.Float(string='Costo anterior MXN', digits=(16, 4))
+    new_cost_mxn = fields.Float(string='Costo nuevo MXN', digits=(16, 4))
+    delta_mxn = fields.Float(string='Variación MXN', digits=(16, 4))
+    base_cost_mxn = fields.Float(string='Costo base MXN', digits=(16, 4))
+    logistics_cost_mxn = fields.Float(string='Logística MXN', digits=(16, 4))
+    duty_cost_mxn = fields.Float(string='Arancel MXN', digits=(16, 4))
+    duty_pct = fields.Float(string='Arancel (%)')
+    exchange_rate = fields.Float(string='TC USD→MXN', digits=(12, 4))
+    freight_tariff_all_in_usd = fields.Float(string='Tarifa All-In USD', digits=(16, 2))
+    container_capacity = fields.Float(string='Capacidad contenedor (m²)')
+    origin_country_id = fields.Many2one('res.country', string='País de Origen')
+    pol_id = fields.Many2one('res.partner', string='POL')
+    pod_id = fields.Many2one('res.partner', string='POD')
+    naviera_id = fields.Many2one('res.partner', string='Naviera')
+    forwarder_id = fields.Many2one('res.partner', string='Forwarder')
+
+    # Pendiente de entrar al resumen del chatter. Lo apaga el cron al
+    # publicarlo: cada fila entra a UN resumen, sin importar si el cron se
+    # atrasa o se corre a mano.
+    digest_pending = fields.Boolean(string='Pendiente de resumen', default=True, copy=False)
+
+    # Las consultas del histórico siempre son "producto X, por fecha".
+    _product_date_idx = models.Index('(product_tmpl_id, date DESC)')
+    # El cron solo busca lo pendiente: índice parcial, casi siempre vacío.
+    _digest_pending_idx = models.Index('(product_tmpl_id, date) WHERE digest_pending')
+
+    @api.model
+    def _cron_post_cost_history_digest(self):
+        """Un solo mensaje de chatter por producto con los cambios de costo
+        aún no resumidos (primer costo → último costo). Si el cambio neto
+        es menor a un centavo no se publica nada."""
+        entries = self.search(
+            [('digest_pending', '=', True)], order='product_tmpl_id, date asc, id asc')
+
+        by_product = defaultdict(list)
+        for entry in entries:
+            by_product[entry.product_tmpl_id].append(entry)
+
+        digested = self.browse()
+        for product, rows in by_product.items():
+            first, last = rows[0], rows[-1]
+            delta = last.new_cost_mxn - first.old_cost_mxn
+            # Idas y vueltas que netean a cero no son noticia: se dan por
+            # resumidas sin publicar.
+            if abs(delta) < 0.01:
+                digested |= self.concat(*rows)
+                continue
+            arrow = '📈' if delta > 0 else '📉'
+            try:
+                product.sudo().message_post(
+                    body=Markup(
+                        "<b>%s Costo ALL-IN (desde el último resumen):</b> "
+                        "$%s → <b>$%s MXN</b> (%s%s) · %s cambio(s)<br/>"
+                        "• Último: Base $%s · Logística $%s · Arancel $%s · TC %s"
+                    ) % (
+                        arrow,
+                        f"{first.old_cost_mxn:,.2f}", f"{last.new_cost_mxn:,.2f}",
+                        '+' if delta > 0 else '', f"{delta:,.2f}", len(rows),
+                        f"{last.base_cost_mxn:,.2f}", f"{last.logistics_cost_mxn:,.2f}",
+                        f"{last.duty_cost_mxn:,.2f}", f"{last.exchange_rate:,.4f}",
+                    ),
+                    message_type='comment',
+                    subtype_xmlid='mail.mt_note',
+                )
+            except Exception:
+                # Sin marcar: entra al siguiente resumen.
+                _logger.exception(
+                    "COSTOS: no se pudo publicar el resumen diario de %s.",
+                    product.display_name,
+                )
+                continue
+            digested |= self.concat(*rows)
+
+        digested.write({'digest_pending': False})
+        return len(by_product)
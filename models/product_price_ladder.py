@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+from odoo.tools import SQL, split_every
+
+
+class ProductPriceLadder(models.Model):
+    """Escalera de precios MATERIALIZADA: una fila angosta por (producto,
+    compañía, moneda, nivel) con su precio y el costo ALL-IN de esa moneda.
+
+    La mantiene el motor de escalera (_calculate_escalera_precios) y sirve
+    para filtrar u ordenar por nivel de precio desde dominios y reportes
+    sin cargar los templates, p. ej.:
+        [('x_price_ladder_ids', 'any', [('currency', '=', 'MXN'),
+                                        ('level', '=', 'high'),
+                                        ('price', '<', 1500)])]
+    """
+    _name = 'product.price.ladder'
+    _description = 'Escalera de precios por nivel'
+    _order = 'product_tmpl_id, currency, sequence'
+
+    product_tmpl_id = fields.Many2one(
+        'product.template', string='Producto', required=True, ondelete='cascade',
+    )
+    company_id = fields.Many2one('res.company', string='Compañía', required=True)
+    currency = fields.Selection(
+        [('MXN', 'MXN'), ('USD', 'USD')], string='Moneda', required=True,
+    )
+    level = fields.Selection([
+        ('high', 'N1'),
+        ('medium', 'N2'),
+        ('minimum', 'N3'),
+        ('level_4', 'N4'),
+        ('level_5', 'N5'),
+    ], string='Nivel', required=True)
+    sequence = fields.Integer(string='Orden', default=1)
+    price = fields.Float(string='Precio', digits=(16, 2))
+    # El costo solo lo ven autorizadores, igual que en la ficha del producto.
+    cost = fields.Float(
+        string='Costo ALL-IN', digits=(16, 4),
+        groups='inventory_shopping_cart.group_price_authorizer',
+    )
+
+    _ladder_unique = models.Constraint(
+        'unique(product_tmpl_id, company_id, currency, level)',
+        'Ya existe ese nivel de precio para el producto.',
+    )
+    # Filtros/orden por precio siempre van por (moneda, nivel).
+    _currency_level_price_idx = models.Index('(currency, level, price)')
+
+    _LEVELS = ('high', 'medium', 'minimum', 'level_4', 'level_5')
+
+    @api.model
+    def _sync_rows(self, rows):
+        """UPSERT por lote. rows = [(tmpl_id, company_id, moneda, nivel,
+        secuencia, precio, costo)]; solo toca las filas que cambiaron."""
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        self.env.cr.execute(SQL(
+            """
+            INSERT INTO product_price_ladder
+                (product_tmpl_id, company_id, currency, level, sequence, price, cost,
+                 create_uid, write_uid, create_date, write_date)
+            SELECT t.*, %(uid)s, %(uid)s, now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM unnest(%(tmpl)s::int[], %(company)s::int[], %(currency)s::varchar[],
+                          %(level)s::varchar[], %(seq)s::int[], %(price)s::float8[],
+                          %(cost)s::float8[]) AS t
+            ON CONFLICT (product_tmpl_id, company_id, currency, level) DO UPDATE
+               SET price = EXCLUDED.price,
+                   cost = EXCLUDED.cost,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+             WHERE abs(product_price_ladder.price - EXCLUDED.price) > 0.0001
+                OR abs(product_price_ladder.cost - EXCLUDED.cost) > 0.0001
+            """,
+            uid=self.env.uid,
+            tmpl=list(columns[0]), company=list(columns[1]),
+            currency=list(columns[2]), level=list(columns[3]),
+            seq=list(columns[4]), price=list(columns[5]), cost=list(columns[6]),
+        ))
+        self.invalidate_model(['price', 'cost', 'write_uid', 'write_date'])
+        # Las filas INSERTADAS por SQL tampoco están en el O2M cacheado del
+        # template: se invalida para que se relean en esta misma transacción.
+        self.env['product.template'].browse(set(columns[0])).invalidate_recordset(
+            ['x_price_ladder_ids'])
+
+    @api.model
+    def _sync_from_templates(self, templates):
+        """Refleja en la tabla la escalera y el costo ALL-IN actuales de los
+        templates para la compañía activa."""
+        Template = self.env['product.template']
+        mxn_fields = Template._LADDER_MXN_FIELDS
+        usd_fields = Template._LADDER_USD_FIELDS
+        company_id = self.env.company.id
+
+        rows = []
+        for tmpl in templates:
+            for seq, (level, mxn_f, usd_f) in enumerate(zip(self._LEVELS, mxn_fields, usd_fields), 1):
+                rows.append((tmpl.id, company_id, 'MXN', level, seq,
+                             tmpl[mxn_f] or 0.0, tmpl.x_costo_mayor or 0.0))
+                rows.append((tmpl.id, company_id, 'USD', level, seq,
+                             tmpl[usd_f] or 0.0, tmpl.x_costo_mayor_usd or 0.0))
+        self._sync_rows(rows)
+
+    @api.model
+    def _som_rebuild_price_ladder(self, chunk_size=1000):
+        """Reconstrucción idempotente de toda la tabla (instalación y -u):
+        después de la primera pasada el UPSERT no encuentra qué cambiar."""
+        Template = self.env['product.template'].with_context(active_test=False)
+        read_fields = list(Template._LADDER_MXN_FIELDS + Template._LADDER_USD_FIELDS) + [
+            'x_costo_mayor', 'x_costo_mayor_usd',
+        ]
+        for ids in split_every(chunk_size, Template.search([]).ids):
+            templates = Template.browse(ids)
+            templates.fetch(read_fields)
+            self._sync_from_templates(templates)
+            Template.invalidate_model()
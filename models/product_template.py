@@ -5,12 +5,14 @@ import requests
 import logging
 import random
 import re
+import time as time_module
+from collections import defaultdict, namedtuple
 from datetime import datetime, timedelta, time
 
-from markupsafe import Markup
 
 from odoo import models, fields, api
-from odoo.exceptions import ValidationError
+from odoo.exceptions import AccessError, ValidationError
+from odoo.tools import split_every
 
 try:
     from zoneinfo import ZoneInfo
@@ -19,6 +21,27 @@ except ImportError:
 
 _logger = logging.getLogger(__name__)
 
+# Foto del TC Banorte vigente: tasa USD→MXN, de qué parámetro salió y la
+# hora del último sync. Se arma una vez por transacción
+# (ProductTemplate._get_banorte_rate_snapshot) y la consumen costeo,
+# escalera, órdenes y apartados.
+BanorteRateSnapshot = namedtuple(
+    'BanorteRateSnapshot', ['rate', 'source', 'last_sync'])
+
+# Sesión HTTP del scraper Banorte, compartida por el proceso: reutiliza la
+# conexión (keep-alive) entre syncs en lugar de abrir una por consulta.
+_banorte_session = None
+
+
+def _get_banorte_session():
+    global _banorte_session
+    if _banorte_session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _banorte_session = session
+    return _banorte_session
 
 
 class ProductTemplate(models.Model):
@@ -26,14 +49,19 @@ class ProductTemplate(models.Model):
 
     # === CAMPOS LOGÍSTICOS Y DE COSTEO AVANZADO ===
 
+    # Los campos de ruta y transportista van INDEXADOS: son el índice de
+    # dependencias del costeo (qué productos recalcular cuando cambia una
+    # tarifa del tarifario).
     x_origin_country_id = fields.Many2one(
         'res.country',
-        string='País de Origen'
+        string='País de Origen',
+        index=True,
     )
 
     x_pol_id = fields.Many2one(
         'res.partner',
         string='Puerto de Carga (POL)',
+        index=True,
         domain="[('category_id.name', '=', 'POL')]",
         help="Puerto donde se embarca la mercancía."
     )
@@ -41,6 +69,7 @@ class ProductTemplate(models.Model):
     x_pod_id = fields.Many2one(
         'res.partner',
         string='Puerto de Destino (POD)',
+        index=True,
         domain="[('category_id.name', '=', 'POD')]",
         help="Puerto donde se descarga la mercancía."
     )
@@ -58,12 +87,12 @@ class ProductTemplate(models.Model):
     )
 
     x_naviera_id = fields.Many2one(
-        'res.partner', string='Naviera (costeo)',
+        'res.partner', string='Naviera (costeo)', index=True,
         help="Naviera de la recepción MÁS COSTOSA registrada. Selecciona la "
              "tarifa correcta del tarifario para el costeo.",
     )
     x_forwarder_id = fields.Many2one(
-        'res.partner', string='Forwarder (costeo)',
+        'res.partner', string='Forwarder (costeo)', index=True,
         help="Forwarder de la recepción más costosa registrada.",
     )
 
@@ -102,6 +131,11 @@ class ProductTemplate(models.Model):
 
     # === CAMPOS DE RASTREO DE COSTOS ===
 
+    x_price_ladder_ids = fields.One2many(
+        'product.price.ladder', 'product_tmpl_id',
+        string='Escalera materializada', readonly=True,
+    )
+
     x_has_purchases = fields.Boolean(
         string='Tiene Compras Confirmadas',
         compute='_compute_costo_all_in',
@@ -324,6 +358,13 @@ class ProductTemplate(models.Model):
     # (la vista de lista está restringida por groups_id). Editar el USD
     # recalcula el MXN con el TC de costeo y viceversa; las utilidades
     # por nivel se recalculan en vivo en la misma fila.
+    x_costing_pending = fields.Selection([
+        ('cost', 'Costo y precios'),
+        ('price', 'Solo precios'),
+    ], string='Recálculo pendiente', copy=False, index=True, readonly=True,
+       help='Técnico: el producto está en la cola diferida de recálculo '
+            '(cambios masivos que procesa el cron).')
+
     x_cost_reviewed = fields.Boolean(
         string='Revisado',
         default=False,
@@ -442,29 +483,58 @@ class ProductTemplate(models.Model):
 
         return float(cleaned or 0.0)
 
+    _BANORTE_SNAPSHOT_KEY = 'inventory_shopping_cart.banorte_rate_snapshot'
+
     @api.model
-    def _get_banorte_usd_to_mxn_rate(self):
-        """
-        Devuelve el TC Banorte venta para convertir USD -> MXN.
+    def _get_banorte_rate_snapshot(self):
+        """TC Banorte vigente como BanorteRateSnapshot, leído UNA vez por
+        transacción. Antes cada producto, orden y apartado volvía a leer
+        los parámetros y a parsear el texto del monto."""
+        cache = self.env.cr.cache
+        snapshot = cache.get(self._BANORTE_SNAPSHOT_KEY)
+        if snapshot is None:
+            snapshot = self._load_banorte_rate_snapshot()
+            cache[self._BANORTE_SNAPSHOT_KEY] = snapshot
+            # Vive lo que la transacción: al cerrar (commit o rollback) se
+            # descarta y la siguiente vuelve a leer los parámetros.
+            self.env.cr.postcommit.add(self._invalidate_banorte_rate_snapshot)
+            self.env.cr.postrollback.add(self._invalidate_banorte_rate_snapshot)
+        return snapshot
 
-        Prioridad:
-        1. banorte.last_rate_sell
-        2. banorte.last_rate
-        """
+    @api.model
+    def _load_banorte_rate_snapshot(self):
+        """Prioridad: banorte.last_rate_sell → banorte.last_rate."""
         icp = self.env['ir.config_parameter'].sudo()
+        last_sync = icp.get_param('banorte.last_sync_at') or False
 
-        for key in ('banorte.last_rate_sell', 'banorte.last_rate'):
-            raw_rate = icp.get_param(key, '0')
-
+        for key, source in (
+            ('banorte.last_rate_sell', 'Banorte venta (banorte.last_rate_sell)'),
+            ('banorte.last_rate', 'Banorte last_rate'),
+        ):
             try:
-                rate = self._parse_money_to_float(raw_rate)
+                rate = self._parse_money_to_float(icp.get_param(key, '0'))
             except Exception:
                 rate = 0.0
 
             if rate > 0:
-                return rate
+                return BanorteRateSnapshot(rate, source, last_sync)
 
-        return 0.0
+        return BanorteRateSnapshot(0.0, '', last_sync)
+
+    @api.model
+    def _invalidate_banorte_rate_snapshot(self):
+        self.env.cr.cache.pop(self._BANORTE_SNAPSHOT_KEY, None)
+
+    @api.model
+    def _get_banorte_usd_to_mxn_rate(self):
+        """
+        Devuelve el TC Banorte venta para convertir USD -> MXN.
+
+        Prioridad:
+        1. banorte.last_rate_sell
+        2. banorte.last_rate
+        """
+        return self._get_banorte_rate_snapshot().rate
 
     @api.model
     def _get_costing_rate_info(self, company=None):
@@ -474,9 +544,9 @@ class ProductTemplate(models.Model):
         company = company or self.env.company
         company_currency = company.currency_id
         usd_currency = self.env.ref('base.USD', raise_if_not_found=False)
-        icp = self.env['ir.config_parameter'].sudo()
+        snapshot = self._get_banorte_rate_snapshot()
 
-        last_sync = icp.get_param('banorte.last_sync_at') or False
+        last_sync = snapshot.last_sync
 
         if not company_currency or not usd_currency:
             return {
@@ -493,19 +563,10 @@ class ProductTemplate(models.Model):
             }
 
         if company_currency.name == 'MXN':
-            rate_sell = self._parse_money_to_float(icp.get_param('banorte.last_rate_sell', '0'))
-            if rate_sell > 0:
-                return {
-                    'rate': rate_sell,
-                    'source': 'Banorte venta (banorte.last_rate_sell)',
-                    'last_sync': last_sync,
-                }
-
-            rate_last = self._parse_money_to_float(icp.get_param('banorte.last_rate', '0'))
-            if rate_last > 0:
+            if snapshot.rate > 0:
                 return {
-                    'rate': rate_last,
-                    'source': 'Banorte last_rate',
+                    'rate': snapshot.rate,
+                    'source': snapshot.source,
                     'last_sync': last_sync,
                 }
 
@@ -531,31 +592,34 @@ class ProductTemplate(models.Model):
             'last_sync': last_sync,
         }
 
+    _EUR_USD_DEFAULT_URL = "https://api.frankfurter.app/latest?from=EUR&to=USD"
+
     @api.model
-    def _get_eur_to_usd_rate_for_costing(self):
+    def _get_eur_to_usd_rate_for_costing(self, allow_network=False):
         """EUR→USD para costeo. El DOF solo publica el dólar, así que la
         fuente del euro es el BANCO CENTRAL EUROPEO (frankfurter.app, sin
-        llave). La última tasa buena se cachea en ir.config_parameter; si el
-        servicio no responde se usa el caché y, en último caso, res.currency.
+        llave). La última tasa buena se cachea en ir.config_parameter y se
+        sirve desde ahí mientras no pase el TTL
+        (som_costing.eur_usd_ttl_hours, 12 h por defecto).
+
+        Solo se consulta al BCE con allow_network=True (el cron Banorte):
+        guardar un producto NUNCA hace red. Sin caché válido se usa el caché
+        vencido y, en último caso, res.currency.
         Flujo cuando la compra es en EUR: EUR→USD (BCE) → USD→MXN (Banorte)."""
         ICP = self.env['ir.config_parameter'].sudo()
-        try:
-            resp = requests.get(
-                "https://api.frankfurter.app/latest?from=EUR&to=USD",
-                timeout=15,
-            )
-            rate = float(resp.json()['rates']['USD'])
-            if rate > 0:
-                ICP.set_param('som_costing.eur_usd_rate', str(rate))
-                ICP.set_param('som_costing.eur_usd_source',
-                              'BCE (frankfurter.app) %s' % resp.json().get('date', ''))
-                return rate, ICP.get_param('som_costing.eur_usd_source')
-        except Exception as e:
-            _logger.warning("COSTOS: BCE EUR→USD no disponible (%s); usando caché.", e)
-
         cached = float(ICP.get_param('som_costing.eur_usd_rate', '0') or 0)
+        source = ICP.get_param('som_costing.eur_usd_source', '') or ''
+
+        if cached > 0 and not self._som_eur_usd_cache_expired():
+            return cached, source
+
+        if allow_network:
+            fetched = self._fetch_eur_to_usd_rate_for_costing()
+            if fetched:
+                return fetched
+
         if cached > 0:
-            return cached, (ICP.get_param('som_costing.eur_usd_source', '') or '') + ' [caché]'
+            return cached, source + ' [caché]'
 
         try:
             eur = self.env.ref('base.EUR')
@@ -565,6 +629,45 @@ class ProductTemplate(models.Model):
         except Exception:
             return 0.0, 'Sin fuente'
 
+    @api.model
+    def _som_eur_usd_cache_expired(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        fetched_at = ICP.get_param('som_costing.eur_usd_fetched_at')
+        if not fetched_at:
+            return True
+        try:
+            ttl_hours = float(ICP.get_param('som_costing.eur_usd_ttl_hours', '12') or 12)
+            fetched_at = fields.Datetime.to_datetime(fetched_at)
+        except (TypeError, ValueError):
+            return True
+        return fields.Datetime.now() - fetched_at >= timedelta(hours=ttl_hours)
+
+    @api.model
+    def _fetch_eur_to_usd_rate_for_costing(self):
+        """Consulta el BCE y guarda la tasa en el caché. Devuelve
+        (tasa, fuente) o False si el servicio no respondió. La URL es
+        configurable (som_costing.eur_usd_url) para apuntar a un servidor
+        local en pruebas."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        url = ICP.get_param('som_costing.eur_usd_url') or self._EUR_USD_DEFAULT_URL
+        try:
+            resp = requests.get(url, timeout=(5, 10))
+            resp.raise_for_status()
+            payload = resp.json()
+            rate = float(payload['rates']['USD'])
+        except Exception as e:
+            _logger.warning("COSTOS: BCE EUR→USD no disponible (%s); usando caché.", e)
+            return False
+
+        if rate <= 0:
+            return False
+
+        source = 'BCE (frankfurter.app) %s' % payload.get('date', '')
+        ICP.set_param('som_costing.eur_usd_rate', str(rate))
+        ICP.set_param('som_costing.eur_usd_source', source)
+        ICP.set_param('som_costing.eur_usd_fetched_at', fields.Datetime.now())
+        return rate, source
+
     @api.model
     def _get_usd_to_company_rate_for_costing(self, company=None):
         """
@@ -606,25 +709,22 @@ class ProductTemplate(models.Model):
         eur_currency = self.env.ref('base.EUR', raise_if_not_found=False)
         usd_to_company_rate = rate_info.get('rate', 0.0)
 
+        # Motor POR LOTE: compras de todo el recordset en una búsqueda,
+        # tarifas de todas sus rutas en otra y una tasa por
+        # (moneda, compañía, fecha) en lugar de un _convert por línea.
+        purchase_lines_by_tmpl = self._som_costing_purchase_lines()
+        tariff_index = self._som_costing_tariff_index()
+        conversion_rates = {}
+        history_vals = []
+
         for record in self:
-            _logger.info("COSTOS: Calculando para producto %s (ID: %s)", record.display_name, record.id)
+            _logger.debug("COSTOS: Calculando para producto %s (ID: %s)", record.display_name, record.id)
 
             record.x_cost_exchange_rate = usd_to_company_rate
             record.x_cost_exchange_rate_source = rate_info.get('source') or ''
             record.x_cost_exchange_rate_last_sync = rate_info.get('last_sync') or False
 
-            po_line_domain = [
-                ('product_id.product_tmpl_id', '=', record.id),
-                ('state', 'in', ['purchase', 'done']),
-            ]
-            # Solo compras ACTIVADAS (publicadas o recibidas) mueven el
-            # promedio: una OC confirmada sin publicar/recibir es invisible
-            # para el costeo, sin importar quién dispare el recálculo.
-            POLine = self.env['purchase.order.line']
-            if 'som_costing_activated' in POLine._fields:
-                po_line_domain.append(('som_costing_activated', '=', True))
-            purchase_lines = POLine.search(
-                po_line_domain, order='date_order asc, id asc')
+            purchase_lines = purchase_lines_by_tmpl.get(record._origin.id, [])
 
             has_purchases = bool(purchase_lines)
             record.x_has_purchases = has_purchases
@@ -644,7 +744,7 @@ class ProductTemplate(models.Model):
                 base_gross_cost_mxn = record.standard_price or 0.0
                 all_in_cost_mxn = base_gross_cost_mxn
 
-                _logger.info("COSTOS: Sin compras. Usando Costo Estándar: %s", all_in_cost_mxn)
+                _logger.debug("COSTOS: Sin compras. Usando Costo Estándar: %s", all_in_cost_mxn)
 
                 record.x_max_avg_cost_mxn = 0.0
 
@@ -675,12 +775,22 @@ class ProductTemplate(models.Model):
                         price_unit_mxn = line.price_unit * eur_usd_rate * usd_to_company_rate
                         used_eur = True
                     elif line_currency != company_currency:
-                        price_unit_mxn = line_currency._convert(
-                            line.price_unit,
-                            company_currency,
-                            line.company_id,
-                            rate_date
+                        # Misma tasa que _convert, pero una sola consulta
+                        # por (moneda, compañía, fecha) para todo el lote.
+                        rate_key = (
+                            line_currency.id,
+                            line.company_id.id,
+                            fields.Date.to_date(rate_date),
                         )
+                        if rate_key not in conversion_rates:
+                            conversion_rates[rate_key] = line_currency._get_conversion_rate(
+                                line_currency,
+                                company_currency,
+                                line.company_id or company,
+                                rate_key[2],
+                            )
+                        price_unit_mxn = company_currency.round(
+                            line.price_unit * conversion_rates[rate_key])
 
                     total_qty += line.product_qty
                     total_val_mxn += line.product_qty * price_unit_mxn
@@ -755,14 +865,14 @@ class ProductTemplate(models.Model):
                     if (record.x_container_capacity or 0.0) <= 1.0:
                         missing_params.append('capacidad de contenedor (> 1 m²)')
 
+                    route_key = (
+                        record.x_origin_country_id.id,
+                        record.x_pol_id.id,
+                        record.x_pod_id.id,
+                    )
                     gate_tariff = None
                     if not missing_params:
-                        gate_tariff = self.env['freight.tariff'].search([
-                            ('country_id', '=', record.x_origin_country_id.id),
-                            ('pol_id', '=', record.x_pol_id.id),
-                            ('pod_id', '=', record.x_pod_id.id),
-                            ('state', '=', 'active'),
-                        ], limit=1)
+                        gate_tariff = tariff_index.get(route_key)
 
                     if missing_params or not gate_tariff:
                         reason = (
@@ -787,12 +897,7 @@ class ProductTemplate(models.Model):
                         and record.x_pod_id
                         and record.x_container_capacity > 0
                     ):
-                        candidates = self.env['freight.tariff'].search([
-                            ('country_id', '=', record.x_origin_country_id.id),
-                            ('pol_id', '=', record.x_pol_id.id),
-                            ('pod_id', '=', record.x_pod_id.id),
-                            ('state', '=', 'active')
-                        ], order='create_date desc')
+                        candidates = gate_tariff
                         # Tarifa de la NAVIERA registrada (la más costosa recibida);
                         # fallback a la más reciente de la ruta si no hay match.
                         tariff = candidates[:1]
@@ -827,7 +932,7 @@ class ProductTemplate(models.Model):
                                 f"{logistics_cost_mxn:.4f} MXN/m²"
                             )
 
-                            _logger.info(
+                            _logger.debug(
                                 "COSTOS: Logística %s | Tarifa All-In USD=%s | Capacidad=%s | "
                                 "USD/m²=%s | TC=%s | Logística %s/m²=%s",
                                 record.display_name,
@@ -891,56 +996,125 @@ class ProductTemplate(models.Model):
                 record.sudo().write({
                     'x_costo_mayor': all_in_cost_mxn
                 })
-                # HISTÓRICO DE COSTOS: cada cambio real del ALL-IN queda en el
-                # chatter del producto con su contexto completo (ruta, naviera,
-                # forwarder, capacidad, arancel, TC). Nunca bloquea el cálculo.
+                # HISTÓRICO DE COSTOS: cada cambio real del ALL-IN queda como
+                # fila numérica en product.cost.history (insertadas por lote
+                # al final). El chatter solo recibe el resumen diario.
                 # Solo cambios >= 1 centavo generan entrada en el histórico
                 # (recalculos con diferencias de fracciones de centavo son
                 # ruido de redondeo, no evolución real del costo).
                 if isinstance(record.id, int) and abs(all_in_cost_mxn - old_cost) >= 0.01:
-                    try:
-                        delta = all_in_cost_mxn - old_cost
-                        arrow = '📈' if delta > 0 else '📉'
-                        ctx_lines = [
-                            f"<b>{arrow} Costo ALL-IN actualizado:</b> "
-                            f"${old_cost:,.2f} → <b>${all_in_cost_mxn:,.2f} MXN</b> "
-                            f"({'+' if delta > 0 else ''}{delta:,.2f})",
-                            f"• Costo base (MaxAvg compras): ${base_gross_cost_mxn:,.2f} MXN",
-                            f"• Logística: ${logistics_cost_mxn:,.2f} MXN · "
-                            f"Arancel: ${duty_cost_mxn:,.2f} MXN "
-                            f"({record.x_arancel_pct:g}%)",
-                        ]
-                        route_bits = []
-                        if record.x_origin_country_id:
-                            route_bits.append(record.x_origin_country_id.name)
-                        if record.x_pol_id:
-                            route_bits.append(record.x_pol_id.name)
-                        if record.x_pod_id:
-                            route_bits.append(record.x_pod_id.name)
-                        if route_bits:
-                            ctx_lines.append("• Ruta: " + " → ".join(route_bits))
-                        carrier_bits = []
-                        if getattr(record, 'x_naviera_id', False) and record.x_naviera_id:
-                            carrier_bits.append(f"Naviera: {record.x_naviera_id.name}")
-                        if getattr(record, 'x_forwarder_id', False) and record.x_forwarder_id:
-                            carrier_bits.append(f"Forwarder: {record.x_forwarder_id.name}")
-                        if carrier_bits:
-                            ctx_lines.append("• " + " · ".join(carrier_bits))
-                        ctx_lines.append(
-                            f"• Capacidad contenedor: {record.x_container_capacity:g} m² · "
-                            f"Tarifa All-In: ${freight_tariff_all_in_usd:,.2f} USD · "
-                            f"TC {usd_to_company_rate:,.4f}"
-                        )
-                        record.sudo().message_post(
-                            body=Markup("<br/>".join(ctx_lines)),
-                            message_type='comment',
-                            subtype_xmlid='mail.mt_note',
-                        )
-                    except Exception:
-                        _logger.exception(
-                            "COSTOS: no se pudo registrar el histórico en el "
-                            "chatter de %s.", record.display_name,
-                        )
+                    history_vals.append({
+                        'product_tmpl_id': record.id,
+                        'old_cost_mxn': old_cost,
+                        'new_cost_mxn': all_in_cost_mxn,
+                        'delta_mxn': all_in_cost_mxn - old_cost,
+                        'base_cost_mxn': base_gross_cost_mxn,
+                        'logistics_cost_mxn': logistics_cost_mxn,
+                        'duty_cost_mxn': duty_cost_mxn,
+                        'duty_pct': record.x_arancel_pct,
+                        'exchange_rate': usd_to_company_rate,
+                        'freight_tariff_all_in_usd': freight_tariff_all_in_usd,
+                        'container_capacity': record.x_container_capacity,
+                        'origin_country_id': record.x_origin_country_id.id,
+                        'pol_id': record.x_pol_id.id,
+                        'pod_id': record.x_pod_id.id,
+                        'naviera_id': record.x_naviera_id.id,
+                        'forwarder_id': record.x_forwarder_id.id,
+                    })
+
+        if history_vals:
+            try:
+                with self.env.cr.savepoint():
+                    self.env['product.cost.history'].sudo().create(history_vals)
+            except Exception:
+                _logger.exception(
+                    "COSTOS: no se pudo registrar el histórico de %s productos.",
+                    len(history_vals),
+                )
+
+    def _som_costing_purchase_lines(self):
+        """Compras que mueven el costeo de TODO el recordset, en una sola
+        búsqueda ordenada por fecha: {template_id: [líneas]}. El orden
+        cronológico es el que necesita el MaxAvg acumulado."""
+        POLine = self.env['purchase.order.line']
+        if not self.ids:
+            return {}
+
+        domain = [
+            ('product_id.product_tmpl_id', 'in', self.ids),
+            ('state', 'in', ['purchase', 'done']),
+        ]
+        # Solo compras ACTIVADAS (publicadas o recibidas) mueven el
+        # promedio: una OC confirmada sin publicar/recibir es invisible
+        # para el costeo, sin importar quién dispare el recálculo.
+        if 'som_costing_activated' in POLine._fields:
+            domain.append(('som_costing_activated', '=', True))
+
+        lines_by_tmpl = defaultdict(list)
+        for line in POLine.search(domain, order='date_order asc, id asc'):
+            lines_by_tmpl[line.product_id.product_tmpl_id.id].append(line)
+        return lines_by_tmpl
+
+    def _som_costing_tariff_index(self):
+        """Tarifas ACTIVAS de todas las rutas del recordset en una sola
+        búsqueda: {(país, POL, POD): tarifas, la más reciente primero}."""
+        routes = {
+            (rec.x_origin_country_id.id, rec.x_pol_id.id, rec.x_pod_id.id)
+            for rec in self
+            if rec.x_origin_country_id and rec.x_pol_id and rec.x_pod_id
+        }
+        if not routes or 'freight.tariff' not in self.env:
+            return {}
+
+        Tariff = self.env['freight.tariff']
+        tariffs = Tariff.search([
+            ('country_id', 'in', list({r[0] for r in routes})),
+            ('pol_id', 'in', list({r[1] for r in routes})),
+            ('pod_id', 'in', list({r[2] for r in routes})),
+            ('state', '=', 'active'),
+        ], order='create_date desc, id desc')
+
+        ids_by_route = defaultdict(list)
+        for tariff in tariffs:
+            key = (tariff.country_id.id, tariff.pol_id.id, tariff.pod_id.id)
+            if key in routes:
+                ids_by_route[key].append(tariff.id)
+        return {key: Tariff.browse(ids) for key, ids in ids_by_route.items()}
+
+    _LADDER_MXN_FIELDS = (
+        'x_price_mxn_1', 'x_price_mxn_2', 'x_price_mxn_3',
+        'x_price_mxn_4', 'x_price_mxn_5',
+    )
+    _LADDER_USD_FIELDS = (
+        'x_price_usd_1', 'x_price_usd_2', 'x_price_usd_3',
+        'x_price_usd_4', 'x_price_usd_5',
+    )
+
+    @api.model
+    def _som_price_ladder(self, base, utilities, rate):
+        """Escalera pura (sin ORM): (5 precios MXN, 5 precios USD) a partir
+        de la base MXN, las 5 utilidades y el TC USD→MXN.
+
+        MARGEN SOBRE EL PRECIO (fórmula oficial del negocio):
+        Precio = Costo / (1 - %). El % capturado es la utilidad como
+        proporción del PRECIO de venta. El caso 100% (divisor 0) es
+        matemáticamente imposible y lo bloquea _check_utilidad_range
+        ANTES de llegar aquí; el recorte del divisor queda solo como
+        red de seguridad para datos históricos.
+        """
+        mxn = [0, 0, 0, 0, 0]
+        if base > 0:
+            for i, utility_pct in enumerate(utilities):
+                divisor = 1 - ((utility_pct or 0.0) / 100.0)
+                if divisor <= 0:
+                    divisor = 0.01
+                mxn[i] = math.ceil(base / divisor)
+
+        if rate > 0:
+            usd = [math.ceil(price / rate) for price in mxn]
+        else:
+            usd = [0, 0, 0, 0, 0]
+        return mxn, usd
 
     def _calculate_escalera_precios(self):
         """
@@ -952,58 +1126,209 @@ class ProductTemplate(models.Model):
         USD:
         - Se divide usando TC Banorte venta.
         - Si Banorte no existe, se usa fallback Odoo.
+
+        Se calcula para todo el recordset y solo se escriben los productos
+        cuya escalera cambió, agrupados por valores idénticos y sin pasar
+        por los disparadores de recálculo del write. Devuelve cuántos
+        productos cambiaron.
         """
         banorte_rate = self._get_usd_to_company_rate_for_costing(self.env.company)
+        ladder_fields = self._LADDER_MXN_FIELDS + self._LADDER_USD_FIELDS
 
-        def _price_from_utility(base, utility_pct):
-            # MARGEN SOBRE EL PRECIO (fórmula oficial del negocio):
-            # Precio = Costo / (1 - %). El % capturado es la utilidad como
-            # proporción del PRECIO de venta. El caso 100% (divisor 0) es
-            # matemáticamente imposible y lo bloquea _check_utilidad_range
-            # ANTES de llegar aquí; el recorte del divisor queda solo como
-            # red de seguridad para datos históricos.
-            divisor = 1 - ((utility_pct or 0.0) / 100.0)
-            if divisor <= 0:
-                divisor = 0.01
-            return math.ceil(base / divisor)
+        self.fetch(list(ladder_fields) + list(self._UTILIDAD_FIELDS) + [
+            'x_pricing_mode', 'x_fixed_price', 'x_costo_mayor', 'x_costo_mayor_usd',
+        ])
 
+        ids_by_ladder = defaultdict(list)
         for record in self:
-            mxn_1 = 0
-            mxn_2 = 0
-            mxn_3 = 0
-            mxn_4 = 0
-            mxn_5 = 0
-
             if record.x_pricing_mode == 'fixed' and record.x_fixed_price > 0:
                 base = record.x_fixed_price
             else:
                 base = record.x_costo_mayor
 
-            if base > 0:
-                mxn_1 = _price_from_utility(base, record.x_utilidad)
-                mxn_2 = _price_from_utility(base, record.x_utilidad_media)
-                mxn_3 = _price_from_utility(base, record.x_utilidad_minima)
-                mxn_4 = _price_from_utility(base, record.x_utilidad_4)
-                mxn_5 = _price_from_utility(base, record.x_utilidad_5)
-
-            usd_1 = math.ceil(mxn_1 / banorte_rate) if banorte_rate > 0 else 0
-            usd_2 = math.ceil(mxn_2 / banorte_rate) if banorte_rate > 0 else 0
-            usd_3 = math.ceil(mxn_3 / banorte_rate) if banorte_rate > 0 else 0
-            usd_4 = math.ceil(mxn_4 / banorte_rate) if banorte_rate > 0 else 0
-            usd_5 = math.ceil(mxn_5 / banorte_rate) if banorte_rate > 0 else 0
-
-            record.sudo().write({
-                'x_price_mxn_1': mxn_1,
-                'x_price_mxn_2': mxn_2,
-                'x_price_mxn_3': mxn_3,
-                'x_price_mxn_4': mxn_4,
-                'x_price_mxn_5': mxn_5,
-                'x_price_usd_1': usd_1,
-                'x_price_usd_2': usd_2,
-                'x_price_usd_3': usd_3,
-                'x_price_usd_4': usd_4,
-                'x_price_usd_5': usd_5,
-            })
+            mxn, usd = self._som_price_ladder(
+                base or 0.0,
+                [record[fname] for fname in self._UTILIDAD_FIELDS],
+                banorte_rate,
+            )
+            ladder = tuple(mxn + usd)
+
+            unchanged = all(
+                abs((record[fname] or 0.0) - value) <= 0.0001
+                for fname, value in zip(ladder_fields, ladder)
+            )
+            if not unchanged:
+                ids_by_ladder[ladder].append(record.id)
+
+        Template = self.sudo().with_context(skip_costing_recompute=True)
+        changed = 0
+        for ladder, ids in ids_by_ladder.items():
+            Template.browse(ids).write(dict(zip(ladder_fields, ladder)))
+            changed += len(ids)
+
+        # Tabla materializada (product.price.ladder): se sincroniza con la
+        # escalera y el costo recién calculados; el UPSERT ignora lo igual.
+        self.env['product.price.ladder'].sudo()._sync_from_templates(
+            self.filtered(lambda r: isinstance(r.id, int))
+        )
+
+        if len(self) > 1:
+            _logger.info(
+                "COSTOS: escalera recalculada para %s productos, %s con cambios.",
+                len(self), changed,
+            )
+        return changed
+
+    # ============================================================
+    # SIMULADOR "¿QUÉ PASA SI?" (solo lectura)
+    # ============================================================
+
+    @api.model
+    def simulate_repricing(self, rate=None, utilities=None, categ_ids=None, chunk_size=2000):
+        """Estima, SIN ESCRIBIR NADA, el efecto de un TC USD→MXN hipotético
+        y/o de otras utilidades sobre la escalera de todo el catálogo activo
+        y sobre las cotizaciones y apartados abiertos.
+
+        - rate: TC hipotético (None = el actual).
+        - utilities: 5 porcentajes de utilidad (None = los de cada producto);
+          con categ_ids solo se aplican a esas categorías.
+
+        El costo se re-estima con la misma descomposición del ALL-IN: la
+        logística internacional (USD) y las compras en euros se mueven con
+        el TC; el costo base en MXN, el arancel y el flete nacional no.
+        Es una ESTIMACIÓN: el ALL-IN real se recalcula con el motor completo.
+        """
+        if not self.env.user.has_group('inventory_shopping_cart.group_price_authorizer'):
+            raise AccessError("Solo los autorizadores de precio pueden simular cambios de precios.")
+
+        current_rate = self._get_usd_to_company_rate_for_costing(self.env.company)
+        sim_rate = float(rate) if rate else current_rate
+        rate_factor = (sim_rate / current_rate) if current_rate > 0 else 1.0
+        if utilities is not None:
+            utilities = [float(u or 0.0) for u in utilities][:5]
+            if len(utilities) != 5 or any(u < 0 or u >= 100 for u in utilities):
+                raise ValidationError("Se requieren 5 utilidades entre 0% y menos de 100%.")
+        categ_ids = set(categ_ids or [])
+
+        ladder_fields = self._LADDER_MXN_FIELDS + self._LADDER_USD_FIELDS
+        read_fields = list(ladder_fields) + list(self._UTILIDAD_FIELDS) + [
+            'x_pricing_mode', 'x_fixed_price', 'x_costo_mayor', 'x_has_purchases',
+            'x_cost_base_mxn', 'x_logistics_cost_usd', 'x_duty_cost_mxn',
+            'x_cost_eur_usd_rate', 'categ_id',
+        ]
+        has_freight_mode = 'x_freight_mode' in self._fields
+        if has_freight_mode:
+            read_fields.append('x_freight_mode')
+
+        levels = ('high', 'medium', 'minimum', 'level_4', 'level_5')
+        old_totals = [0.0] * 5
+        new_totals = [0.0] * 5
+        old_margin = new_margin = 0.0
+        total = 0
+        # {tmpl_id: ({nivel: precio viejo}, {nivel: precio nuevo})} por moneda
+        ladders = {'MXN': {}, 'USD': {}}
+
+        for ids in split_every(chunk_size, self.search([('active', '=', True)]).ids):
+            templates = self.browse(ids)
+            templates.fetch(read_fields)
+            for tmpl in templates:
+                total += 1
+                cost = tmpl.x_costo_mayor or 0.0
+                international = not has_freight_mode or tmpl.x_freight_mode != 'national'
+                if tmpl.x_has_purchases:
+                    base = tmpl.x_cost_base_mxn or 0.0
+                    if tmpl.x_cost_eur_usd_rate:
+                        base *= rate_factor
+                    logistics = (tmpl.x_logistics_cost_usd or 0.0) * sim_rate if international \
+                        else cost - (tmpl.x_cost_base_mxn or 0.0) - (tmpl.x_duty_cost_mxn or 0.0)
+                    new_cost = base + logistics + (tmpl.x_duty_cost_mxn or 0.0)
+                else:
+                    new_cost = cost
+
+                if tmpl.x_pricing_mode == 'fixed' and tmpl.x_fixed_price > 0:
+                    base_price = tmpl.x_fixed_price
+                else:
+                    base_price = new_cost
+                tmpl_utilities = [tmpl[f] for f in self._UTILIDAD_FIELDS]
+                if utilities is not None and (not categ_ids or tmpl.categ_id.id in categ_ids):
+                    tmpl_utilities = utilities
+                mxn, usd = self._som_price_ladder(base_price or 0.0, tmpl_utilities, sim_rate)
+
+                old_mxn = [tmpl[f] or 0.0 for f in self._LADDER_MXN_FIELDS]
+                old_usd = [tmpl[f] or 0.0 for f in self._LADDER_USD_FIELDS]
+                for i in range(5):
+                    old_totals[i] += old_mxn[i]
+                    new_totals[i] += mxn[i]
+                old_margin += old_mxn[0] - cost
+                new_margin += mxn[0] - new_cost
+
+                if old_mxn != mxn or old_usd != usd:
+                    ladders['MXN'][tmpl.id] = (dict(zip(levels, old_mxn)), dict(zip(levels, mxn)))
+                    ladders['USD'][tmpl.id] = (dict(zip(levels, old_usd)), dict(zip(levels, usd)))
+            self.invalidate_model(read_fields)
+
+        changed_ids = list(ladders['MXN'])
+        return {
+            'rate': {'current': current_rate, 'simulated': sim_rate},
+            'products': {'total': total, 'changed': len(changed_ids)},
+            'levels': [{
+                'level': level,
+                'label': self._PRICE_LEVEL_LABELS[level],
+                'old_total_mxn': old_totals[i],
+                'new_total_mxn': new_totals[i],
+                'delta_pct': ((new_totals[i] - old_totals[i]) / old_totals[i] * 100.0)
+                if old_totals[i] else 0.0,
+            } for i, level in enumerate(levels)],
+            'margin_n1_mxn': {
+                'old': old_margin, 'new': new_margin, 'delta': new_margin - old_margin,
+            },
+            'sale_orders': self._som_simulate_open_lines(
+                'sale.order.line',
+                [('order_id.state', 'in', ('draft', 'sent')), ('display_type', '=', False)],
+                'price_unit', ladders, changed_ids,
+            ),
+            'holds': self._som_simulate_open_lines(
+                'stock.lot.hold.order.line',
+                [('order_id.state', 'in', ('draft', 'confirmed'))],
+                'precio_unitario', ladders, changed_ids,
+            ),
+        }
+
+    @api.model
+    def _som_simulate_open_lines(self, model_name, domain, price_field, ladders, tmpl_ids):
+        """Líneas abiertas de los productos que cambiarían y cuántas
+        quedarían NUEVAS debajo del umbral de su vendedor."""
+        result = {'orders': 0, 'lines': 0, 'newly_low_orders': 0, 'newly_low_lines': 0}
+        if not tmpl_ids or model_name not in self.env:
+            return result
+
+        threshold_by_user = {}
+        orders, low_orders = set(), set()
+        for ids in split_every(5000, tmpl_ids):
+            lines = self.env[model_name].search_fetch(
+                domain + [('product_id.product_tmpl_id', 'in', list(ids))],
+                [price_field, 'order_id', 'product_id', 'currency_id'],
+            )
+            for line in lines:
+                order = line.order_id
+                user = order.user_id if 'user_id' in order._fields else self.env.user
+                if user.id not in threshold_by_user:
+                    threshold_by_user[user.id] = self._get_user_threshold_level(user=user)
+                threshold = threshold_by_user[user.id]
+
+                currency_code = 'MXN' if line.currency_id.name == 'MXN' else 'USD'
+                old, new = ladders[currency_code][line.product_id.product_tmpl_id.id]
+                price = line[price_field] or 0.0
+
+                result['lines'] += 1
+                orders.add(order.id)
+                if price < new[threshold] - 0.01 and not price < old[threshold] - 0.01:
+                    result['newly_low_lines'] += 1
+                    low_orders.add(order.id)
+
+        result['orders'] = len(orders)
+        result['newly_low_orders'] = len(low_orders)
+        return result
 
     def write(self, vals):
         res = super(ProductTemplate, self).write(vals)
@@ -1038,13 +1363,191 @@ class ProductTemplate(models.Model):
             return res
 
         if any(f in vals for f in triggers):
-            self._compute_costo_all_in()
-            self._calculate_escalera_precios()
+            self._som_queue_costing_recompute()
         elif any(f in vals for f in price_triggers):
-            self._calculate_escalera_precios()
+            self._som_queue_costing_recompute(prices_only=True)
+        else:
+            return res
+
+        # som_costing_defer: los flujos masivos solo ENCOLAN y vacían la
+        # cola una vez al final (o al commit); la edición normal recalcula
+        # en el acto para que la vista muestre el costo nuevo.
+        if not self.env.context.get('som_costing_defer'):
+            self._som_flush_costing_queue()
 
         return res
 
+    # ============================================================
+    # COLA DE RECÁLCULO DE COSTOS
+    # ============================================================
+
+    _COSTING_QUEUE_KEY = 'inventory_shopping_cart.costing_queue'
+
+    def _som_queue_costing_recompute(self, prices_only=False):
+        """Encola el recálculo (ALL-IN + escalera, o solo escalera) de estos
+        templates. La cola vive en la transacción y deduplica ids: varios
+        write sobre el mismo producto lo recalculan UNA sola vez. Lo que
+        quede encolado se vacía antes del commit."""
+        ids = [tid for tid in self.ids if tid]
+        if not ids:
+            return
+
+        precommit = self.env.cr.precommit
+        queue = precommit.data.get(self._COSTING_QUEUE_KEY)
+        if queue is None:
+            queue = precommit.data[self._COSTING_QUEUE_KEY] = {
+                'cost': set(), 'price': set(), 'scheduled': False,
+            }
+
+        queue['price' if prices_only else 'cost'].update(ids)
+        # El vaciado se (re)agenda cada vez que la cola ya fue drenada: lo
+        # que se encole DURANTE el commit (recompute de campos, escrituras
+        # del propio vaciado) no se pierde con precommit.clear().
+        if not queue['scheduled']:
+            queue['scheduled'] = True
+            precommit.add(self._som_flush_costing_queue)
+
+    @api.model
+    def _som_flush_costing_queue(self):
+        """Vacía la cola de recálculo. Lotes chicos se calculan aquí mismo;
+        lotes grandes (más de som_costing.queue_inline_limit, 200 por
+        defecto) se marcan como pendientes y los procesa el cron."""
+        queue = self.env.cr.precommit.data.get(self._COSTING_QUEUE_KEY)
+        if not queue:
+            return
+        queue['scheduled'] = False
+
+        try:
+            inline_limit = int(self.env['ir.config_parameter'].sudo().get_param(
+                'som_costing.queue_inline_limit', '200') or 200)
+        except ValueError:
+            inline_limit = 200
+
+        # Hasta vaciarla: el recálculo y su flush pueden encolar más.
+        while queue['cost'] or queue['price']:
+            cost_ids = set(queue['cost'])
+            price_ids = set(queue['price']) - cost_ids
+            queue['cost'].clear()
+            queue['price'].clear()
+
+            if len(cost_ids) + len(price_ids) > inline_limit:
+                self._som_mark_costing_pending(cost_ids, price_ids)
+                continue
+
+            cost_products = self.browse(sorted(cost_ids)).exists()
+            price_products = self.browse(sorted(price_ids)).exists()
+            if cost_products:
+                cost_products._compute_costo_all_in()
+            (cost_products | price_products)._calculate_escalera_precios()
+            self.env.flush_all()
+
+    @api.model
+    def _som_mark_costing_pending(self, cost_ids, price_ids):
+        Template = self.sudo().with_context(skip_costing_recompute=True)
+        if cost_ids:
+            Template.browse(sorted(cost_ids)).write({'x_costing_pending': 'cost'})
+        if price_ids:
+            pending_price = Template.browse(sorted(price_ids)).filtered(
+                lambda p: p.x_costing_pending != 'cost')
+            pending_price.write({'x_costing_pending': 'price'})
+        self.env.flush_all()
+
+        cron = self.env.ref(
+            'inventory_shopping_cart.ir_cron_som_costing_queue',
+            raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+        _logger.info(
+            "COSTOS: %s productos encolados para recálculo diferido "
+            "(%s costo, %s solo precios).",
+            len(cost_ids) + len(price_ids), len(cost_ids), len(price_ids),
+        )
+
+    # ============================================================
+    # DEPENDENCIAS DEL COSTEO (recálculo incremental)
+    # ============================================================
+    # Qué productos dependen de qué insumo del costeo. Cada disparador
+    # (tarifa, ruta nacional, activación de compra, TC) encola SOLO esos
+    # productos en la cola de recálculo, en lugar de todo el catálogo.
+
+    @api.model
+    def _som_costing_dependents_of_tariffs(self, tariffs):
+        """Productos internacionales con compras cuya ruta (país, POL,
+        POD) es la de alguna de estas tarifas. La naviera/forwarder solo
+        elige ENTRE las tarifas de la ruta, así que la ruta basta."""
+        routes = {
+            (t.country_id.id, t.pol_id.id, t.pod_id.id)
+            for t in tariffs
+            if t.country_id and t.pol_id and t.pod_id
+        }
+        if not routes:
+            return self.browse()
+
+        domain = [
+            ('x_has_purchases', '=', True),
+            ('x_origin_country_id', 'in', list({r[0] for r in routes})),
+            ('x_pol_id', 'in', list({r[1] for r in routes})),
+            ('x_pod_id', 'in', list({r[2] for r in routes})),
+        ]
+        if 'x_freight_mode' in self._fields:
+            domain.append(('x_freight_mode', '!=', 'national'))
+
+        return self.search(domain).filtered(lambda p: (
+            p.x_origin_country_id.id, p.x_pol_id.id, p.x_pod_id.id,
+        ) in routes)
+
+    @api.model
+    def _som_costing_dependents_of_national_routes(self, routes):
+        """Productos en modo nacional que usan alguna de estas rutas del
+        Tarifario Nacional."""
+        if not routes or 'x_national_route_id' not in self._fields:
+            return self.browse()
+        return self.search([
+            ('x_has_purchases', '=', True),
+            ('x_freight_mode', '=', 'national'),
+            ('x_national_route_id', 'in', routes.ids),
+        ])
+
+    @api.model
+    def _som_costing_dependents_of_purchase_lines(self, lines):
+        """Productos cuyo MaxAvg puede moverse con estas líneas de compra."""
+        return lines.product_id.product_tmpl_id
+
+    @api.model
+    def _som_costing_dependents_of_rate(self):
+        """El TC USD→MXN entra en TODA la escalera USD y en las columnas USD
+        del costeo, así que un cambio de tasa alcanza a todo el catálogo
+        activo. Por eso el sync solo recalcula cuando la tasa CAMBIA."""
+        return self.search([('active', '=', True)])
+
+    @api.model
+    def _som_queue_costing_for_national_routes(self, routes):
+        """Punto de entrada para el Tarifario Nacional (freight_national_route):
+        encola los productos que usan estas rutas."""
+        self._som_costing_dependents_of_national_routes(routes)._som_queue_costing_recompute()
+
+    @api.model
+    def _cron_som_process_costing_queue(self, batch_size=500):
+        """Procesa los productos marcados como pendientes por bloques, con
+        commit por bloque."""
+        for mode in ('cost', 'price'):
+            while True:
+                products = self.search(
+                    [('x_costing_pending', '=', mode)], limit=batch_size)
+                if not products:
+                    break
+                if mode == 'cost':
+                    products._compute_costo_all_in()
+                products._calculate_escalera_precios()
+                products.sudo().with_context(
+                    skip_costing_recompute=True,
+                ).write({'x_costing_pending': False})
+                self.env.cr.commit()
+                _logger.info(
+                    "COSTOS: cola diferida — %s productos procesados (%s).",
+                    len(products), mode)
+        return True
+
     # ============================================================
     # BANORTE SYNC
     # ============================================================
@@ -1105,7 +1608,87 @@ class ProductTemplate(models.Model):
         return candidate_utc
 
     @api.model
-    def _reschedule_banorte_cron_sql(self):
+    def _fetch_banorte_payload(self, api_url, api_key):
+        """
+        Consulta el scraper Banorte con sesión reutilizable, timeouts cortos
+        y reintentos acotados con backoff exponencial y jitter.
+
+        Parámetros de sistema (opcionales):
+        - banorte.connect_timeout (5 s) y banorte.read_timeout (15 s).
+        - banorte.max_attempts (3 intentos en total).
+        - banorte.backoff_seconds (2 s, base del backoff; tope 10 s).
+
+        Reintenta solo lo transitorio (conexión, timeout, 429 y 5xx); un
+        4xx (p. ej. llave inválida) falla de inmediato. Devuelve el JSON.
+        """
+        icp = self.env['ir.config_parameter'].sudo()
+
+        def _param(key, default):
+            try:
+                return float(icp.get_param(key) or default)
+            except (TypeError, ValueError):
+                return default
+
+        timeout = (_param('banorte.connect_timeout', 5.0), _param('banorte.read_timeout', 15.0))
+        attempts = max(1, int(_param('banorte.max_attempts', 3)))
+        backoff = _param('banorte.backoff_seconds', 2.0)
+
+        session = _get_banorte_session()
+        for attempt in range(1, attempts + 1):
+            try:
+                response = session.get(api_url, headers={"x-api-key": api_key}, timeout=timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.exceptions.HTTPError(
+                        "HTTP %s" % response.status_code, response=response)
+                response.raise_for_status()
+                return response.json()
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                status = e.response.status_code if getattr(e, 'response', None) is not None else None
+                transient = status is None or status == 429 or status >= 500
+                if not transient or attempt == attempts:
+                    raise
+                # Full jitter: espera aleatoria entre 0 y el backoff del
+                # intento, para no golpear al scraper todos a la vez.
+                delay = random.uniform(0, min(10.0, backoff * (2 ** (attempt - 1))))
+                _logger.warning(
+                    "BANORTE SYNC: intento %s/%s falló (%s); reintento en %.1f s",
+                    attempt, attempts, e, delay,
+                )
+                time_module.sleep(delay)
+
+    @api.model
+    def _get_banorte_retry_run_utc(self):
+        """
+        Reintento CERCANO tras un sync fallido: en banorte.retry_minutes
+        (10 por defecto, ±jitter) si cae dentro de la ventana 08:00-20:00
+        y no se han encadenado más de banorte.max_consecutive_failures (3)
+        fallos. Si no, None: se usa el calendario normal.
+        """
+        icp = self.env['ir.config_parameter'].sudo()
+        try:
+            failures = int(icp.get_param('banorte.consecutive_failures') or 0)
+            max_failures = int(icp.get_param('banorte.max_consecutive_failures') or 3)
+            retry_minutes = float(icp.get_param('banorte.retry_minutes') or 10)
+        except (TypeError, ValueError):
+            return None
+
+        if failures > max_failures:
+            return None
+
+        now_utc = datetime.utcnow()
+        candidate_utc = now_utc + timedelta(minutes=retry_minutes * random.uniform(0.8, 1.2))
+
+        tz = self._banorte_local_tz()
+        if tz:
+            candidate_local = candidate_utc.replace(tzinfo=ZoneInfo("UTC")).astimezone(tz)
+            if not time(8, 0) <= candidate_local.time() < time(20, 0):
+                return None
+        return candidate_utc
+
+    @api.model
+    def _reschedule_banorte_cron_sql(self, next_run_utc=None):
         """
         Odoo 19 no permite write() al mismo cron mientras está ejecutándose.
         Por eso aquí se actualiza nextcall vía SQL.
@@ -1122,7 +1705,7 @@ class ProductTemplate(models.Model):
             )
             return
 
-        next_run_utc = self._get_next_banorte_run_utc()
+        next_run_utc = next_run_utc or self._get_next_banorte_run_utc()
         nextcall_str = fields.Datetime.to_string(next_run_utc)
 
         self.env.cr.execute("""
@@ -1144,8 +1727,10 @@ class ProductTemplate(models.Model):
         - API_KEY en ir.config_parameter.
 
         Importante:
-        - Recalcula costos ALL-IN porque la logística depende del TC Banorte.
-        - Después recalcula escalera de precios.
+        - Solo si la tasa cambió, encola el recálculo de costos ALL-IN y
+          escalera (la logística y el USD dependen del TC Banorte).
+        - La consulta reintenta lo transitorio (_fetch_banorte_payload); si
+          aun así falla, el cron se reprograma para un reintento cercano.
         """
         icp = self.env['ir.config_parameter'].sudo()
         # La URL del scraper vive ÚNICAMENTE en el parámetro de sistema
@@ -1186,15 +1771,9 @@ class ProductTemplate(models.Model):
 
             return False
 
-        headers = {
-            "x-api-key": api_key
-        }
-
+        synced = False
         try:
-            response = requests.get(api_url, headers=headers, timeout=90)
-            response.raise_for_status()
-
-            data = response.json()
+            data = self._fetch_banorte_payload(api_url, api_key)
             _logger.warning("BANORTE RAW RESPONSE: %s", data)
 
             buy_raw = data.get("tipo-cambio-compra-banorte")
@@ -1206,12 +1785,18 @@ class ProductTemplate(models.Model):
             if rate_sell <= 0:
                 raise ValueError(f"Tipo de cambio venta inválido: {sell_raw}")
 
+            previous_rate = self._get_banorte_rate_snapshot().rate
+
             # Guardar tipo de cambio primero
             icp.set_param('banorte.last_rate', rate_sell)
             icp.set_param('banorte.last_rate_buy', rate_buy)
             icp.set_param('banorte.last_rate_sell', rate_sell)
             icp.set_param('banorte.last_payload', str(data))
             icp.set_param('banorte.last_sync_at', fields.Datetime.now())
+            icp.set_param('banorte.consecutive_failures', 0)
+            # La foto del TC de esta transacción ya no vale: el recálculo de
+            # abajo debe leer la tasa recién guardada.
+            self._invalidate_banorte_rate_snapshot()
 
             # Histórico si existe el modelo
             if 'banorte.rate.log' in self.env:
@@ -1227,32 +1812,43 @@ class ProductTemplate(models.Model):
             # COMMIT inmediato para que el TC quede persistido
             self.env.cr.commit()
 
-            # Recalcular productos:
-            # 1. Costo ALL-IN porque logística usa Banorte.
-            # 2. Escalera de precios porque USD también usa Banorte.
-            products = self.search([('active', '=', True)])
-            products._compute_costo_all_in()
-            products._calculate_escalera_precios()
-
-            # Recalcular órdenes abiertas
-            if 'sale.order' in self.env:
-                orders = self.env['sale.order'].search([
-                    ('state', 'in', ['draft', 'sent'])
-                ])
-                orders._compute_exchange_rate()
+            # EUR→USD del BCE: se refresca aquí (con su TTL) y el costeo de
+            # abajo lo lee del caché, igual que cualquier guardado.
+            previous_eur = self._get_eur_to_usd_rate_for_costing()[0]
+            current_eur = self._get_eur_to_usd_rate_for_costing(allow_network=True)[0]
+
+            # Recalcular productos SOLO si cambió algo de lo que dependen:
+            # 1. TC USD→MXN: logística, columnas USD y escalera USD (todo
+            #    el catálogo activo).
+            # 2. Solo EUR→USD: los productos con compras en euros.
+            # Se encola: lotes grandes los procesa el cron de la cola.
+            rate_changed = abs(rate_sell - previous_rate) > 0.00001
+            if rate_changed:
+                products = self._som_costing_dependents_of_rate()
+            elif abs(current_eur - previous_eur) > 0.000001:
+                products = self.search([('x_cost_eur_usd_rate', '>', 0)])
             else:
-                orders = self.env['sale.order']
+                products = self.browse()
+            products._som_queue_costing_recompute()
+            self._som_flush_costing_queue()
 
             self.env.cr.commit()
 
+            # Refrescar órdenes abiertas: solo si la tasa de venta cambió y
+            # solo las que dependen de ella (incremental y por bloques).
+            orders_count = 0
+            if 'sale.order' in self.env and rate_changed:
+                orders_count = self.env['sale.order']._som_refresh_banorte_rate_orders()
+
             _logger.info(
                 "BANORTE SYNC OK | compra=%s venta=%s | productos recalculados=%s | ordenes recalculadas=%s",
                 rate_buy,
                 rate_sell,
                 len(products),
-                len(orders)
+                orders_count
             )
 
+            synced = True
             return True
 
         except Exception as e:
@@ -1278,7 +1874,14 @@ class ProductTemplate(models.Model):
 
         finally:
             try:
-                self._reschedule_banorte_cron_sql()
+                # Fallo: reintento cercano en vez de esperar al siguiente
+                # salto del calendario (45-90 min, o mañana de noche).
+                next_run_utc = None
+                if not synced:
+                    failures = int(icp.get_param('banorte.consecutive_failures') or 0) + 1
+                    icp.set_param('banorte.consecutive_failures', failures)
+                    next_run_utc = self._get_banorte_retry_run_utc()
+                self._reschedule_banorte_cron_sql(next_run_utc=next_run_utc)
                 self.env.cr.commit()
             except Exception:
                 self.env.cr.rollback()
@@ -1348,17 +1951,18 @@ class ProductTemplate(models.Model):
             'inventory_shopping_cart.group_dashboard_viewer')
 
     @api.model
-    def _get_user_visible_price_levels(self):
+    def _get_user_visible_price_levels(self, role=None):
         """
         Devuelve la lista de niveles ('high', 'medium', 'minimum', 'level_4', 'level_5')
-        que el usuario actual puede ver en los selectores.
+        que el usuario actual puede ver en los selectores. Con `role` ya
+        resuelto no se vuelven a consultar los grupos del usuario.
 
         - Vendedor regular: 1-2.
         - Vendedor mayorista: 1-4 (el Precio 5 es el piso absoluto y NO se le
           muestra; para bajar de ahí pide autorización).
         - Autorizador y visor del Dashboard: 1-5.
         """
-        role = self._get_user_price_role()
+        role = role or self._get_user_price_role()
         if role == 'authorizer':
             return ['high', 'medium', 'minimum', 'level_4', 'level_5']
         if role == 'mayorista':
@@ -1376,11 +1980,31 @@ class ProductTemplate(models.Model):
         - Autorizador: level_5 (debajo del Precio 5 requiere autorización).
         """
         role = self._get_user_price_role(user=user)
-        if role == 'authorizer':
-            return 'level_5'
-        if role == 'mayorista':
-            return 'level_4'
-        return 'medium'
+        return self._THRESHOLD_LEVEL_BY_ROLE.get(role, 'medium')
+
+    _THRESHOLD_LEVEL_BY_ROLE = {
+        'authorizer': 'level_5',
+        'mayorista': 'level_4',
+    }
+
+    # Campo de la escalera por (moneda, nivel). Cualquier moneda distinta de
+    # MXN lee la escalera USD, igual que siempre.
+    _PRICE_LEVEL_FIELDS = {
+        'MXN': {
+            'high': 'x_price_mxn_1',
+            'medium': 'x_price_mxn_2',
+            'minimum': 'x_price_mxn_3',
+            'level_4': 'x_price_mxn_4',
+            'level_5': 'x_price_mxn_5',
+        },
+        'USD': {
+            'high': 'x_price_usd_1',
+            'medium': 'x_price_usd_2',
+            'minimum': 'x_price_usd_3',
+            'level_4': 'x_price_usd_4',
+            'level_5': 'x_price_usd_5',
+        },
+    }
 
     @api.model
     def _get_price_level_value(self, tmpl, level, currency_code):
@@ -1388,66 +2012,114 @@ class ProductTemplate(models.Model):
         if not tmpl:
             return 0.0
 
-        if currency_code == 'MXN':
-            mapping = {
-                'high': tmpl.x_price_mxn_1,
-                'medium': tmpl.x_price_mxn_2,
-                'minimum': tmpl.x_price_mxn_3,
-                'level_4': tmpl.x_price_mxn_4,
-                'level_5': tmpl.x_price_mxn_5,
-            }
-        else:
-            mapping = {
-                'high': tmpl.x_price_usd_1,
-                'medium': tmpl.x_price_usd_2,
-                'minimum': tmpl.x_price_usd_3,
-                'level_4': tmpl.x_price_usd_4,
-                'level_5': tmpl.x_price_usd_5,
-            }
-        return mapping.get(level, 0.0) or 0.0
+        mapping = self._PRICE_LEVEL_FIELDS['MXN' if currency_code == 'MXN' else 'USD']
+        fname = mapping.get(level)
+        if not fname:
+            return 0.0
+        return tmpl[fname] or 0.0
 
     @api.model
-    def get_custom_prices(self, product_id, currency_code):
-        product_variant = self.env['product.product'].browse(int(product_id))
-        product = product_variant.product_tmpl_id if product_variant.exists() else self.browse(int(product_id))
+    def _get_price_level_values_batch(self, templates, currency_code):
+        """Escalera completa de VARIOS templates en una sola lectura.
 
-        visible_levels = self._get_user_visible_price_levels()
-        threshold_level = self._get_user_threshold_level()
+        Devuelve {tmpl_id: {level: valor}} con la misma regla que
+        _get_price_level_value (MXN → escalera MXN; cualquier otra → USD).
+        Los evaluadores por lote (bandera de precios bajos, autorizaciones)
+        lo usan para no leer el template nivel por nivel y orden por orden.
+        """
+        mapping = self._PRICE_LEVEL_FIELDS['MXN' if currency_code == 'MXN' else 'USD']
+        templates = templates.exists()
+        if not templates:
+            return {}
 
-        # Mismo nombre que en el tooltip del Inventario Visual, en las
-        # autorizaciones y en la ficha del producto: "Precio 1"…"Precio 5".
-        # (Antes traían doble espacio y paréntesis: 'Precio  (1)'.)
-        labels = {
-            'high': 'Precio 1',
-            'medium': 'Precio 2',
-            'minimum': 'Precio 3',
-            'level_4': 'Precio 4',
-            'level_5': 'Precio 5',
+        templates.fetch(list(mapping.values()))
+        return {
+            tmpl.id: {
+                level: tmpl[fname] or 0.0
+                for level, fname in mapping.items()
+            }
+            for tmpl in templates
         }
 
-        prices = []
-        for level in visible_levels:
-            prices.append({
-                'label': labels.get(level, level),
-                'value': self._get_price_level_value(product, level, currency_code),
+    # Mismo nombre que en el tooltip del Inventario Visual, en las
+    # autorizaciones y en la ficha del producto: "Precio 1"…"Precio 5".
+    # (Antes traían doble espacio y paréntesis: 'Precio  (1)'.)
+    _PRICE_LEVEL_LABELS = {
+        'high': 'Precio 1',
+        'medium': 'Precio 2',
+        'minimum': 'Precio 3',
+        'level_4': 'Precio 4',
+        'level_5': 'Precio 5',
+    }
+
+    @api.model
+    def _som_templates_by_product_id(self, product_ids):
+        """Resuelve por lote los ids que mandan los wizards (variante o, si
+        no existe, template): {id: (variante, template)}. Los ids que no
+        existen como ninguno de los dos no vienen en el resultado."""
+        ids = []
+        for pid in product_ids or []:
+            try:
+                ids.append(int(pid))
+            except (TypeError, ValueError):
+                continue
+
+        variants = self.env['product.product'].browse(ids).exists()
+        variants.fetch(['product_tmpl_id'])
+        result = {v.id: (v, v.product_tmpl_id) for v in variants}
+
+        missing = [pid for pid in ids if pid not in result]
+        for tmpl in self.browse(missing).exists():
+            result[tmpl.id] = (self.env['product.product'], tmpl)
+        return result
+
+    @api.model
+    def get_custom_prices(self, product_id, currency_code):
+        return self.get_custom_prices_batch([product_id], currency_code).get(int(product_id), [])
+
+    @api.model
+    def get_custom_prices_batch(self, product_ids, currency_code):
+        """Opciones de precio de TODO el carrito en una sola llamada:
+        {product_id: [{label, value, level, is_threshold}]}. El rol se
+        resuelve una vez y la escalera se lee de todos los templates juntos."""
+        role = self._get_user_price_role()
+        visible_levels = self._get_user_visible_price_levels(role=role)
+        threshold_level = self._THRESHOLD_LEVEL_BY_ROLE.get(role, 'medium')
+
+        resolved = self._som_templates_by_product_id(product_ids)
+        templates = self.browse({tmpl.id for _variant, tmpl in resolved.values()})
+        ladders = self._get_price_level_values_batch(templates, currency_code)
+
+        result = {}
+        for pid, (_variant, tmpl) in resolved.items():
+            ladder = ladders.get(tmpl.id, {})
+            result[pid] = [{
+                'label': self._PRICE_LEVEL_LABELS.get(level, level),
+                'value': ladder.get(level, 0.0),
                 'level': level,
                 'is_threshold': level == threshold_level,
-            })
-
-        return prices
+            } for level in visible_levels]
+        return result
 
     @api.model
     def get_price_tooltip_data(self, product_id):
         """Precios de referencia por ROL (lo consume el Inventario Visual):
         vendedor regular ve niveles 1-2; mayorista, 1-4; autorizador y visor
         del Dashboard, 1-5."""
-        product = self.env['product.product'].browse(product_id)
+        return self.get_price_tooltip_data_batch([product_id]).get(product_id, {})
 
-        if not product.exists():
+    @api.model
+    def get_price_tooltip_data_batch(self, product_ids):
+        """Tooltip de precios de VARIAS variantes en una llamada:
+        {product_id: datos de get_price_tooltip_data}."""
+        products = self.env['product.product'].browse(product_ids).exists()
+        if not products:
             return {}
 
-        tmpl = product.product_tmpl_id
         role = self._get_user_price_role()
+        products.product_tmpl_id.fetch(
+            list(self._LADDER_MXN_FIELDS + self._LADDER_USD_FIELDS)
+        )
 
         # Las etiquetas van NUMERADAS ('Precio 1'…'Precio 5'), que es como
         # se le nombra a la escalera en toda la casa. Antes decían
@@ -1455,35 +2127,35 @@ class ProductTemplate(models.Model):
         # carrito, en las autorizaciones y en la orden se habla de Precio 1
         # y Precio 2. El color del punto sigue marcando qué tan abajo va
         # cada nivel (verde arriba → rojo en el piso).
-        levels = [
-            {'label': 'Precio 1', 'dot': '#28a745',
-             'usd': tmpl.x_price_usd_1, 'mxn': tmpl.x_price_mxn_1},
-            {'label': 'Precio 2', 'dot': '#ffc107',
-             'usd': tmpl.x_price_usd_2, 'mxn': tmpl.x_price_mxn_2},
-        ]
-        if role in ('mayorista', 'authorizer'):
-            levels += [
-                {'label': 'Precio 3', 'dot': '#fd7e14',
-                 'usd': tmpl.x_price_usd_3, 'mxn': tmpl.x_price_mxn_3},
-                {'label': 'Precio 4', 'dot': '#6f42c1',
-                 'usd': tmpl.x_price_usd_4, 'mxn': tmpl.x_price_mxn_4},
-            ]
+        dots = ['#28a745', '#ffc107', '#fd7e14', '#6f42c1', '#dc3545']
         # El Precio 5 (mínimo absoluto) es exclusivo del autorizador y del
         # visor del Dashboard: el mayorista NO lo ve.
         if role == 'authorizer':
-            levels += [
-                {'label': 'Precio 5', 'dot': '#dc3545',
-                 'usd': tmpl.x_price_usd_5, 'mxn': tmpl.x_price_mxn_5},
-            ]
-
-        return {
-            'levels': levels,
-            # Compatibilidad con consumidores viejos del tooltip
-            'usd_high': tmpl.x_price_usd_1,
-            'usd_medium': tmpl.x_price_usd_2,
-            'mxn_high': tmpl.x_price_mxn_1,
-            'mxn_medium': tmpl.x_price_mxn_2,
-        }
+            count = 5
+        elif role == 'mayorista':
+            count = 4
+        else:
+            count = 2
+
+        result = {}
+        for product in products:
+            tmpl = product.product_tmpl_id
+            levels = [{
+                'label': f'Precio {n}',
+                'dot': dots[n - 1],
+                'usd': tmpl[f'x_price_usd_{n}'],
+                'mxn': tmpl[f'x_price_mxn_{n}'],
+            } for n in range(1, count + 1)]
+
+            result[product.id] = {
+                'levels': levels,
+                # Compatibilidad con consumidores viejos del tooltip
+                'usd_high': tmpl.x_price_usd_1,
+                'usd_medium': tmpl.x_price_usd_2,
+                'mxn_high': tmpl.x_price_mxn_1,
+                'mxn_medium': tmpl.x_price_mxn_2,
+            }
+        return result
 
     @api.model
     def check_price_authorization_needed(self, product_prices, currency_code):
@@ -1508,7 +2180,9 @@ class ProductTemplate(models.Model):
                 'role': role,
             }
 
-        threshold_level = self._get_user_threshold_level()
+        # El rol ya está resuelto: el umbral sale de él sin volver a
+        # consultar los grupos del usuario.
+        threshold_level = self._THRESHOLD_LEVEL_BY_ROLE.get(role, 'medium')
         threshold_label_map = {
             'medium': 'Precio 2',
             'minimum': 'Precio 3',
@@ -1516,11 +2190,17 @@ class ProductTemplate(models.Model):
             'level_5': 'Precio 5',
         }
 
-        for product_id_str, requested_price in (product_prices or {}).items():
-            product_variant = self.env['product.product'].browse(int(product_id_str))
-            product = product_variant.product_tmpl_id if product_variant.exists() else self.browse(int(product_id_str))
+        # Todo el carrito de una vez: variantes/templates resueltos en lote
+        # y escalera leída de todos los templates en una sola lectura.
+        product_prices = product_prices or {}
+        resolved = self._som_templates_by_product_id(list(product_prices))
+        templates = self.browse({tmpl.id for _variant, tmpl in resolved.values()})
+        ladders = self._get_price_level_values_batch(templates, currency_code)
 
-            if not product.exists():
+        for product_id_str, requested_price in product_prices.items():
+            try:
+                product_variant, product = resolved[int(product_id_str)]
+            except (KeyError, TypeError, ValueError):
                 continue
 
             try:
@@ -1528,21 +2208,18 @@ class ProductTemplate(models.Model):
             except Exception:
                 requested_price = 0.0
 
-            medium = self._get_price_level_value(product, 'medium', currency_code)
-            minimum = self._get_price_level_value(product, 'minimum', currency_code)
-            level_4 = self._get_price_level_value(product, 'level_4', currency_code)
-            level_5 = self._get_price_level_value(product, 'level_5', currency_code)
-            threshold = self._get_price_level_value(product, threshold_level, currency_code)
+            ladder = ladders.get(product.id, {})
+            threshold = ladder.get(threshold_level, 0.0)
 
             if threshold > 0 and requested_price < (threshold - 0.01):
                 needs_auth.append({
                     'product_id': int(product_id_str),
-                    'product_name': product_variant.display_name if product_variant.exists() else product.display_name,
+                    'product_name': (product_variant or product).display_name,
                     'requested_price': requested_price,
-                    'medium_price': medium,
-                    'minimum_price': minimum,
-                    'level_4_price': level_4,
-                    'level_5_price': level_5,
+                    'medium_price': ladder.get('medium', 0.0),
+                    'minimum_price': ladder.get('minimum', 0.0),
+                    'level_4_price': ladder.get('level_4', 0.0),
+                    'level_5_price': ladder.get('level_5', 0.0),
                     'threshold_price': threshold,
                     'threshold_label': threshold_label_map.get(threshold_level, threshold_level),
                 })
@@ -1578,8 +2255,11 @@ class ProductProduct(models.Model):
         res = super(ProductProduct, self).write(vals)
 
         if 'standard_price' in vals:
-            for product in self:
-                product.product_tmpl_id._compute_costo_all_in()
-                product.product_tmpl_id._calculate_escalera_precios()
+            # Por template y deduplicado: el write del template también
+            # encola, y varias variantes del mismo producto cuentan una vez.
+            templates = self.product_tmpl_id
+            templates._som_queue_costing_recompute()
+            if not self.env.context.get('som_costing_defer'):
+                templates._som_flush_costing_queue()
 
         return res
\ No newline at end of file
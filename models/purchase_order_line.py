@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class PurchaseOrderLine(models.Model):
+    _inherit = 'purchase.order.line'
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Publicar/recibir una compra la ACTIVA para el costeo: se encolan
+        # solo sus productos. Los flujos que ya recalculan por su cuenta
+        # escriben con skip_costing_recompute.
+        if 'som_costing_activated' in vals and not self.env.context.get('skip_costing_recompute'):
+            self.env['product.template']._som_costing_dependents_of_purchase_lines(
+                self
+            )._som_queue_costing_recompute()
+        return res
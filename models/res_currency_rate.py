@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+
+class ResCurrencyRate(models.Model):
+    _inherit = 'res.currency.rate'
+
+    # El TC oficial de órdenes y apartados se memoriza por (compañía, fecha)
+    # en sale.order._som_official_rate_cached: cualquier alta, cambio o baja
+    # de tasas lo invalida para que nadie siga viendo el cruce viejo.
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+
+class ResourceCalendarLeaves(models.Model):
+    _inherit = 'resource.calendar.leaves'
+
+    # Los feriados globales (sin recurso) alimentan el calendario de días
+    # hábiles de los apartados (stock.lot.hold.order._som_business_calendar,
+    # memorizado por compañía): solo su alta, cambio o baja lo invalida. Las
+    # ausencias por empleado no tocan la caché. El parámetro som_hold.holidays
+    # ya limpia la caché al escribirse.
+
+    def _som_has_global_leaves(self):
+        return any(not leave.resource_id for leave in self)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        if records._som_has_global_leaves():
+            self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        touches_global = self._som_has_global_leaves()
+        res = super().write(vals)
+        if touches_global or self._som_has_global_leaves():
+            self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        touches_global = self._som_has_global_leaves()
+        res = super().unlink()
+        if touches_global:
+            self.env.registry.clear_cache()
+        return res
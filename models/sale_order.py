@@ -4,12 +4,13 @@
 import math
 import logging
 import re
+from collections import defaultdict
 
 from markupsafe import Markup
 
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools import html2plaintext
+from odoo.tools import html2plaintext, split_every
 
 _logger = logging.getLogger(__name__)
 
@@ -839,6 +840,54 @@ class SaleOrder(models.Model):
 
         return sale_order.exists()[:1]
 
+    @api.model
+    def _som_is_weak_cart_reservation(self, move_line):
+        """Reserva DÉBIL: traslado interno abierto de carrito/escáner."""
+        picking = move_line.picking_id
+        return bool(
+            picking
+            and picking.picking_type_code == 'internal'
+            and (picking.origin or '').startswith('Carrito - ')
+        )
+
+    @api.model
+    def _get_native_reservation_blocked_quants(self, quants):
+        """Versión POR LOTE de _get_native_reservation_blockers (sin orden
+        ni pickings permitidos): una sola búsqueda de move lines para todos
+        los quants y el cruce por (producto, lote, ubicación, paquete,
+        propietario, compañía) en memoria. Devuelve los quants bloqueados."""
+        quants = quants.filtered('lot_id')
+        if not quants:
+            return quants
+
+        move_lines = self.env['stock.move.line'].sudo().search_fetch([
+            ('product_id', 'in', quants.product_id.ids),
+            ('lot_id', 'in', quants.lot_id.ids),
+            ('location_id', 'in', quants.location_id.ids),
+            ('state', 'in', ['assigned', 'partially_available']),
+            ('quantity', '>', 0),
+        ], ['product_id', 'lot_id', 'location_id', 'package_id', 'owner_id',
+            'company_id', 'picking_id'])
+
+        companies_by_key = defaultdict(set)
+        for ml in move_lines:
+            if self._som_is_weak_cart_reservation(ml):
+                continue
+            key = (ml.product_id.id, ml.lot_id.id, ml.location_id.id,
+                   ml.package_id.id, ml.owner_id.id)
+            companies_by_key[key].add(ml.company_id.id)
+
+        def _blocked(quant):
+            companies = companies_by_key.get((
+                quant.product_id.id, quant.lot_id.id, quant.location_id.id,
+                quant.package_id.id, quant.owner_id.id,
+            ))
+            if not companies:
+                return False
+            return not quant.company_id or quant.company_id.id in companies
+
+        return quants.filtered(_blocked)
+
     def _get_native_reservation_blockers(self, quant, allowed_order=False, allowed_pickings=False):
         """
         Busca reservas nativas activas del mismo quant lógico.
@@ -883,11 +932,7 @@ class SaleOrder(models.Model):
         # caché aún lo trae. OJO: solo origin 'Carrito - %' — los pickings
         # internos multi-step de una venta (Existencias -> Salida) llevan la
         # SO en origin y SÍ deben bloquear.
-        blockers = blockers.filtered(lambda ml: not (
-            ml.picking_id
-            and ml.picking_id.picking_type_code == 'internal'
-            and (ml.picking_id.origin or '').startswith('Carrito - ')
-        ))
+        blockers = blockers.filtered(lambda ml: not self._som_is_weak_cart_reservation(ml))
 
         if allowed_pickings:
             allowed_picking_ids = set(allowed_pickings.ids)
@@ -1097,9 +1142,11 @@ class SaleOrder(models.Model):
 
     @api.depends('x_exchange_rate_source', 'pricelist_id', 'pricelist_id.currency_id')
     def _compute_exchange_rate(self):
+        # Las dos tasas no dependen de la orden: se resuelven una vez para
+        # todo el lote (listas de órdenes, refresco tras el sync Banorte).
+        banorte_rate = self._get_banorte_rate()
+        official_rate = self._get_official_rate()
         for order in self:
-            banorte_rate = order._get_banorte_rate()
-            official_rate = order._get_official_rate()
             order.x_exchange_rate = official_rate if order.x_exchange_rate_source == 'official' else banorte_rate
 
     @api.onchange('x_exchange_rate_source', 'pricelist_id')
@@ -1113,46 +1160,44 @@ class SaleOrder(models.Model):
         Antes se leía solo last_rate con float() estricto: si el valor traía
         formato, caía en silencio al TC oficial (DOF) aunque la etiqueta
         siguiera diciendo 'Banorte'."""
-        icp = self.env['ir.config_parameter'].sudo()
-        Product = self.env['product.template']
-        for key in ('banorte.last_rate_sell', 'banorte.last_rate'):
-            try:
-                rate = Product._parse_money_to_float(icp.get_param(key, '0'))
-            except Exception:
-                rate = 0.0
-            if rate > 0:
-                return rate
+        rate = self.env['product.template']._get_banorte_rate_snapshot().rate
+        if rate > 0:
+            return rate
 
         return self._get_official_rate()
 
     def _get_official_rate(self):
+        """TC oficial USD→MXN (cruce de res.currency.rate) de HOY para la
+        compañía actual. Memorizado por (compañía, fecha): cada compute de
+        órdenes y apartados lo pide, y son dos búsquedas de tasas que solo
+        cambian cuando se captura una tasa nueva (res.currency.rate limpia
+        el caché al crear/editar/borrar)."""
+        return self._som_official_rate_cached(
+            self.env.company.id, fields.Date.to_string(fields.Date.today()))
+
+    @api.model
+    @tools.ormcache('company_id', 'date_str')
+    def _som_official_rate_cached(self, company_id, date_str):
         usd = self.env.ref('base.USD', raise_if_not_found=False)
         mxn = self.env.ref('base.MXN', raise_if_not_found=False)
 
         if not usd or not mxn:
             return 1.0
 
-        today = fields.Date.today()
-        company = self.env.company
-
-        rate_rec_usd = self.env['res.currency.rate'].sudo().search([
-            ('currency_id', '=', usd.id),
-            ('name', '<=', today),
-            '|',
-            ('company_id', '=', company.id),
-            ('company_id', '=', False),
-        ], order='name desc, company_id', limit=1)
+        Rate = self.env['res.currency.rate'].sudo()
 
-        rate_rec_mxn = self.env['res.currency.rate'].sudo().search([
-            ('currency_id', '=', mxn.id),
-            ('name', '<=', today),
-            '|',
-            ('company_id', '=', company.id),
-            ('company_id', '=', False),
-        ], order='name desc, company_id', limit=1)
+        def _last_rate(currency):
+            rate_rec = Rate.search([
+                ('currency_id', '=', currency.id),
+                ('name', '<=', date_str),
+                '|',
+                ('company_id', '=', company_id),
+                ('company_id', '=', False),
+            ], order='name desc, company_id', limit=1)
+            return rate_rec.rate if rate_rec else 1.0
 
-        usd_rate = rate_rec_usd.rate if rate_rec_usd else 1.0
-        mxn_rate = rate_rec_mxn.rate if rate_rec_mxn else 1.0
+        usd_rate = _last_rate(usd)
+        mxn_rate = _last_rate(mxn)
 
         if usd_rate > 0:
             rate = mxn_rate / usd_rate
@@ -1194,27 +1239,64 @@ class SaleOrder(models.Model):
         # recompute — un autorizador tocando la orden la evaluaba con
         # umbral Precio 5 y un vendedor con Precio 2: dos verdades para el
         # mismo documento.
+        flags = self._som_low_price_flags()
+        for order in self:
+            order.x_has_low_prices = flags.get(order.id, False)
+
+    def _som_low_price_flags(self):
+        """Evaluador POR LOTE de la bandera de precios bajos.
+
+        Misma regla que la evaluación orden por orden, pero resolviendo una
+        sola vez lo que antes se repetía por orden y por línea:
+        - Umbral y exención del candado por VENDEDOR (no por orden).
+        - Escalera de todos los templates involucrados por moneda, en una
+          lectura (_get_price_level_values_batch).
+        Devuelve {order.id: bool}.
+        """
         Product = self.env['product.template']
+        flags = {}
+
+        # 1. Política por vendedor: umbral de la escalera y exención (visor
+        #    del Dashboard). Un has_group por usuario, no por orden.
+        policy = {}
+        for user in self.user_id | self.env.user:
+            policy[user.id] = (
+                Product._get_user_threshold_level(user=user),
+                Product._som_user_is_price_exempt(user),
+            )
+
+        # 2. Órdenes que realmente se evalúan y su moneda.
+        to_check = []
         for order in self:
-            threshold_level = Product._get_user_threshold_level(
-                user=order.user_id or self.env.user)
-            if order._som_is_migrated_order():
-                order.x_has_low_prices = False
-                continue
-            # VISOR DEL DASHBOARD como vendedor de la orden: exento del
-            # candado — sus precios no se bloquean por debajo del nivel
-            # que sea (imprime/confirma/envía sin flujo de autorización y
-            # sin botón de solicitar, porque la bandera nunca prende).
-            if Product._som_user_is_price_exempt(
-                    order.user_id or self.env.user):
-                order.x_has_low_prices = False
+            user = order.user_id or self.env.user
+            threshold_level, exempt = policy[user.id]
+            # Parche temporal: órdenes migradas (referencia con 3+ dígitos).
+            # VISOR DEL DASHBOARD como vendedor: exento del candado — sus
+            # precios no se bloquean por debajo del nivel que sea.
+            if exempt or order._som_is_migrated_order():
+                flags[order.id] = False
                 continue
+            currency_code = order.pricelist_id.currency_id.name or 'USD' if order.pricelist_id else 'USD'
+            to_check.append((order, threshold_level, currency_code))
+
+        # 3. Escalera de todos los templates de esas órdenes, por moneda.
+        templates_by_currency = defaultdict(lambda: Product.browse())
+        for order, _level, currency_code in to_check:
+            templates_by_currency[currency_code] |= \
+                order.order_line.product_id.product_tmpl_id
+        ladders = {
+            currency_code: Product._get_price_level_values_batch(
+                templates, currency_code)
+            for currency_code, templates in templates_by_currency.items()
+        }
+
+        # 4. Comparación línea contra umbral y contra piso autorizado.
+        for order, threshold_level, currency_code in to_check:
             approved = bool(
                 order.x_price_authorization_id
                 and order.x_price_authorization_id.state == 'approved')
             floors = order.x_authorized_floor_json or {}
-
-            currency_code = order.pricelist_id.currency_id.name or 'USD' if order.pricelist_id else 'USD'
+            ladder = ladders.get(currency_code) or {}
             has_low = False
 
             for line in order.order_line:
@@ -1231,14 +1313,16 @@ class SaleOrder(models.Model):
                 if approved:
                     continue
 
-                tmpl = line.product_id.product_tmpl_id
-                threshold = Product._get_price_level_value(tmpl, threshold_level, currency_code)
+                levels = ladder.get(line.product_id.product_tmpl_id.id) or {}
+                threshold = levels.get(threshold_level, 0.0)
 
                 if threshold > 0 and line.price_unit < (threshold - 0.01):
                     has_low = True
                     break
 
-            order.x_has_low_prices = has_low
+            flags[order.id] = has_low
+
+        return flags
 
     def _get_violating_products(self):
         self.ensure_one()
@@ -2134,16 +2218,50 @@ class SaleOrder(models.Model):
                 return res
         return super().write(vals)
 
+    @api.model
+    def _som_refresh_banorte_rate_orders(self, chunk_size=500):
+        """Refresco de órdenes después del sync Banorte.
+
+        Solo cotizaciones (draft/sent) cuya fuente de TC es Banorte y sin
+        TC congelado por entrega: las que están en DOF no dependen de la
+        tasa nueva. Se procesan por bloques con commit y avance en el log,
+        para no retener miles de cotizaciones en una sola transacción.
+        Devuelve cuántas órdenes se refrescaron.
+        """
+        order_ids = self.search([
+            ('state', 'in', ['draft', 'sent']),
+            ('x_exchange_rate_source', '=', 'banorte'),
+            ('x_delivery_exchange_rate', '=', 0),
+        ]).ids
+        total = len(order_ids)
+        done = 0
+
+        for chunk_ids in split_every(chunk_size, order_ids):
+            self.browse(chunk_ids)._compute_exchange_rate()
+            self.env.flush_all()
+            self.env.cr.commit()
+            self.env.invalidate_all()
+            done += len(chunk_ids)
+            _logger.info(
+                "BANORTE SYNC: órdenes refrescadas %s/%s", done, total)
+
+        return total
+
     @api.model
     def _som_recompute_low_price_flags(self):
         """Recalcula x_has_low_prices de las órdenes activas con la regla
         nueva (rol del VENDEDOR de la orden). Corre en cada -u: banderas
         almacenadas con el criterio viejo quedaban pegadas."""
-        orders = self.search([('state', 'in', ('draft', 'sent', 'sale'))])
-        orders._compute_has_low_prices()
+        order_ids = self.search([('state', 'in', ('draft', 'sent', 'sale'))]).ids
+        # Por bloques: el evaluador resuelve vendedores y escalera una vez
+        # por bloque, y el caché del ORM no crece con miles de órdenes.
+        for chunk_ids in split_every(1000, order_ids):
+            self.browse(chunk_ids)._compute_has_low_prices()
+            self.env.flush_all()
+            self.env.invalidate_all()
         _logger.info(
             '[PRECIOS] Bandera de precios bajos recalculada en %s órdenes '
-            'activas.', len(orders))
+            'activas.', len(order_ids))
         return True
 
     def action_request_authorization(self):
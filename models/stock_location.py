@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields
+
+
+class StockLocation(models.Model):
+    _inherit = 'stock.location'
+
+    # Filtro por ubicación del selector de placas: ilike sobre la ruta
+    # completa ("SOM/Existencias/Patio A"). El nombre de lote ya trae
+    # índice trigram desde el core (stock.lot.name).
+    complete_name = fields.Char(index='trigram')
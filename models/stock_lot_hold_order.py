@@ -2,9 +2,10 @@
 import math
 import logging
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 from odoo.exceptions import UserError
 
 
@@ -231,6 +232,10 @@ class StockLotHoldOrder(models.Model):
         for order in self:
             order.x_can_renew = is_authorizer or order.x_renew_count < 1
 
+    # El cron de vencimiento solo recorre apartados confirmados por fecha:
+    # índice parcial para que la búsqueda no barra todo el histórico.
+    _som_expiry_idx = models.Index("(fecha_expiracion) WHERE state = 'confirmed'")
+
     @api.model
     def _default_hold_currency_id(self):
         usd = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
@@ -246,6 +251,100 @@ class StockLotHoldOrder(models.Model):
 
         return fields.Datetime.from_string(value)
 
+    # ------------------------------------------------------------------
+    # Calendario de días hábiles (fines de semana + feriados por compañía)
+    # ------------------------------------------------------------------
+    # Ventana precalculada alrededor del año en curso; fuera de ella se cae
+    # al recorrido día por día de siempre.
+    _BUSINESS_CALENDAR_YEARS_BACK = 1
+    _BUSINESS_CALENDAR_YEARS_AHEAD = 3
+
+    @api.model
+    def _som_hold_holiday_dates(self, company_id):
+        """Feriados de la compañía: ausencias globales del calendario laboral
+        (resource.calendar.leaves sin recurso) más la lista opcional del
+        parámetro som_hold.holidays (fechas ISO separadas por coma)."""
+        holidays = set()
+
+        param = self.env['ir.config_parameter'].sudo().get_param('som_hold.holidays') or ''
+        for chunk in param.split(','):
+            chunk = chunk.strip()
+            if not chunk:
+                continue
+            try:
+                holidays.add(fields.Date.from_string(chunk))
+            except ValueError:
+                _logger.warning("som_hold.holidays: fecha inválida %r ignorada", chunk)
+
+        if 'resource.calendar.leaves' in self.env:
+            company = self.env['res.company'].browse(company_id)
+            calendar = company.resource_calendar_id if 'resource_calendar_id' in company._fields else False
+            leaves = self.env['resource.calendar.leaves'].sudo().search_fetch([
+                ('resource_id', '=', False),
+                ('calendar_id', 'in', [calendar.id, False] if calendar else [False]),
+                ('company_id', 'in', [company_id, False]),
+            ], ['date_from', 'date_to', 'calendar_id'])
+            default_tz = (calendar and calendar.tz) or company.partner_id.tz or 'UTC'
+            for leave in leaves:
+                if not leave.date_from or not leave.date_to:
+                    continue
+                # date_from/date_to vienen en UTC: el día del feriado es el
+                # LOCAL del calendario (un feriado completo en UTC-6 termina
+                # a las 05:59 UTC del día siguiente).
+                tz = self._som_zoneinfo(leave.calendar_id.tz or default_tz)
+                day = self._som_utc_to_local_date(leave.date_from, tz)
+                last_day = self._som_utc_to_local_date(leave.date_to, tz)
+                while day <= last_day:
+                    holidays.add(day)
+                    day += timedelta(days=1)
+
+        return holidays
+
+    @api.model
+    def _som_zoneinfo(self, tz_name):
+        try:
+            return ZoneInfo(tz_name or 'UTC')
+        except (ZoneInfoNotFoundError, ValueError):
+            return timezone.utc
+
+    @api.model
+    def _som_utc_to_local_date(self, value, tz):
+        return value.replace(tzinfo=timezone.utc).astimezone(tz).date()
+
+    @api.model
+    @tools.ormcache('company_id', 'year')
+    def _som_business_calendar(self, company_id, year):
+        """Precalcula la ventana [año-1, año+3] de la compañía:
+          - prefix[i]: días hábiles en [inicio, inicio + i).
+          - business: ordinales de los días hábiles, en orden.
+        Con eso "sumar N días hábiles" y "días hábiles entre" son O(1).
+        Se invalida con registry.clear_cache() (parámetros, ausencias)."""
+        start = date(year - self._BUSINESS_CALENDAR_YEARS_BACK, 1, 1)
+        end = date(year + self._BUSINESS_CALENDAR_YEARS_AHEAD, 12, 31)
+        holidays = self._som_hold_holiday_dates(company_id)
+
+        start_ord = start.toordinal()
+        prefix = [0]
+        business = []
+        for ordinal in range(start_ord, end.toordinal() + 1):
+            day = date.fromordinal(ordinal)
+            if day.weekday() < 5 and day not in holidays:
+                business.append(ordinal)
+            prefix.append(len(business))
+
+        return start_ord, tuple(prefix), tuple(business)
+
+    def _som_calendar_company_id(self):
+        record = self[:1]
+        if record and 'company_id' in record._fields and record.company_id:
+            return record.company_id.id
+        return self.env.company.id
+
+    def _som_get_business_calendar(self):
+        return self._som_business_calendar(
+            self._som_calendar_company_id(), fields.Date.context_today(self).year,
+        )
+
     @api.model
     def _get_default_fecha_expiracion(self, fecha_orden=None, business_days=5):
         """
@@ -259,10 +358,20 @@ class StockLotHoldOrder(models.Model):
         if business_days <= 0:
             business_days = 5
 
+        start_ord, prefix, business = self._som_get_business_calendar()
+        offset = current.toordinal() - start_ord
+        if 0 <= offset < len(prefix) - 1:
+            # prefix[offset + 1] = hábiles hasta el día de la orden inclusive;
+            # el N-ésimo hábil siguiente está justo N posiciones después.
+            target = prefix[offset + 1] + business_days - 1
+            if target < len(business):
+                return current + timedelta(days=business[target] - current.toordinal())
+
+        holidays = self._som_hold_holiday_dates(self._som_calendar_company_id())
         added = 0
         while added < business_days:
             current += timedelta(days=1)
-            if current.weekday() < 5:
+            if current.weekday() < 5 and current.date() not in holidays:
                 added += 1
 
         return current
@@ -277,79 +386,53 @@ class StockLotHoldOrder(models.Model):
         if end_dt <= start_dt:
             return 0
 
+        # Hábiles en (inicio, fin] por fecha = diferencia de acumulados.
+        start_ord, prefix, business = self._som_get_business_calendar()
+        first = start_dt.toordinal() - start_ord
+        last = end_dt.toordinal() - start_ord
+        if 0 <= first and last < len(prefix) - 1:
+            return prefix[last + 1] - prefix[first + 1]
+
+        holidays = self._som_hold_holiday_dates(self._som_calendar_company_id())
         current = start_dt
         count = 0
 
         while current.date() < end_dt.date():
             current += timedelta(days=1)
-            if current.weekday() < 5:
+            if current.weekday() < 5 and current.date() not in holidays:
                 count += 1
 
         return count
 
+    def _compute_x_days_to_expiration(self):
+        now = fields.Datetime.now()
+
+        for order in self:
+            order.x_days_to_expiration = order._count_business_days_between(
+                now,
+                order.fecha_expiracion,
+            )
+
     @api.depends(
         'line_ids',
         'line_ids.cantidad_m2',
-        'line_ids.precio_unitario',
-        'line_ids.x_subtotal',
-        'line_ids.product_id',
-        'line_ids.product_id.taxes_id',
-        'partner_id',
-        'partner_id.property_account_position_id',
-        'currency_id',
+        'line_ids.x_untaxed_amount',
+        'line_ids.x_tax_amount',
     )
     def _compute_hold_totals(self):
+        # Los impuestos ya están calculados y guardados POR LÍNEA
+        # (_compute_x_tax_amount): aquí solo se suman, sin volver a
+        # correr compute_all por cada línea.
         for order in self:
-            total_m2 = 0.0
-            amount_untaxed = 0.0
-            amount_tax = 0.0
-
-            company = order.company_id or self.env.company
-            currency = order.currency_id or company.currency_id
-            fpos = order.partner_id.property_account_position_id
-
-            for line in order.line_ids:
-                qty = line.cantidad_m2 or 0.0
-                price = line.precio_unitario or 0.0
-                total_m2 += qty
-
-                # Impuestos reales configurados en el producto (taxes de venta),
-                # filtrados por compañía y mapeados por la posición fiscal del cliente.
-                taxes = self.env['account.tax']
-                if line.product_id:
-                    taxes = line.product_id.taxes_id.filtered(
-                        lambda t: t.company_id == company
-                    )
-                    if fpos:
-                        taxes = fpos.map_tax(taxes)
-
-                if taxes:
-                    res = taxes.compute_all(
-                        price,
-                        currency=currency,
-                        quantity=qty,
-                        product=line.product_id,
-                        partner=order.partner_id,
-                    )
-                    amount_untaxed += res['total_excluded']
-                    amount_tax += res['total_included'] - res['total_excluded']
-                else:
-                    amount_untaxed += qty * price
+            lines = order.line_ids
+            amount_untaxed = sum(lines.mapped('x_untaxed_amount'))
+            amount_tax = sum(lines.mapped('x_tax_amount'))
 
-            order.x_total_m2 = total_m2
+            order.x_total_m2 = sum(lines.mapped('cantidad_m2'))
             order.x_amount_total = amount_untaxed
             order.x_amount_tax = amount_tax
             order.x_amount_total_taxed = amount_untaxed + amount_tax
 
-    def _compute_x_days_to_expiration(self):
-        now = fields.Datetime.now()
-
-        for order in self:
-            order.x_days_to_expiration = order._count_business_days_between(
-                now,
-                order.fecha_expiracion,
-            )
-
     @api.onchange('fecha_orden', 'x_hold_business_days')
     def _onchange_fecha_orden_set_expiration(self):
         for order in self:
@@ -500,33 +583,52 @@ class StockLotHoldOrder(models.Model):
         - Servicios: no participan en la escalera ni en autorización de precio.
         """
         self.ensure_one()
+        return self._get_manual_price_violations_batch()[self.id]
 
-        violations = []
+    def _get_manual_price_violations_batch(self):
+        """Misma política que _get_manual_price_violations para VARIOS
+        apartados en una pasada: {hold_id: [violaciones]}.
+
+        Rol y umbral se resuelven una vez y la escalera de todos los
+        templates involucrados se lee con una sola lectura por moneda, en
+        lugar de cinco lecturas por línea."""
         Product = self.env['product.template']
         role = Product._get_user_price_role()
-        threshold_level = Product._get_user_threshold_level()
-        threshold_label_map = {
-            'medium': 'Precio 2',
-            'minimum': 'Precio 3',
-            'level_4': 'Precio 4',
-            'level_5': 'Precio 5',
-        }
-        threshold_label = threshold_label_map.get(threshold_level, threshold_level)
+        threshold_level = Product._THRESHOLD_LEVEL_BY_ROLE.get(role, 'medium')
+        threshold_label = Product._PRICE_LEVEL_LABELS.get(threshold_level, threshold_level)
 
-        for line in self.line_ids:
-            if not line.product_id or line.product_id.type == 'service':
-                continue
+        # 1. Líneas evaluables y su moneda (MXN o escalera USD).
+        work = []
+        templates_by_currency = defaultdict(set)
+        for order in self:
+            for line in order.line_ids:
+                if not line.product_id or line.product_id.type == 'service':
+                    continue
 
-            currency_code = line._get_currency_code() if hasattr(line, '_get_currency_code') else (
-                self.currency_id.name if self.currency_id else 'USD'
-            )
-            tmpl = line.product_id.product_tmpl_id
+                currency_code = line._get_currency_code() if hasattr(line, '_get_currency_code') else (
+                    order.currency_id.name if order.currency_id else 'USD'
+                )
+                ladder_key = 'MXN' if currency_code == 'MXN' else 'USD'
+                tmpl = line.product_id.product_tmpl_id
+                templates_by_currency[ladder_key].add(tmpl.id)
+                work.append((order, line, ladder_key, tmpl.id))
+
+        # 2. Escalera completa de todos los templates, una lectura por moneda.
+        ladders = {
+            ladder_key: Product._get_price_level_values_batch(
+                Product.browse(sorted(tmpl_ids)), ladder_key)
+            for ladder_key, tmpl_ids in templates_by_currency.items()
+        }
 
-            medium_price = Product._get_price_level_value(tmpl, 'medium', currency_code)
-            minimum_price = Product._get_price_level_value(tmpl, 'minimum', currency_code)
-            level_4_price = Product._get_price_level_value(tmpl, 'level_4', currency_code)
-            level_5_price = Product._get_price_level_value(tmpl, 'level_5', currency_code)
-            threshold = Product._get_price_level_value(tmpl, threshold_level, currency_code)
+        # 3. Evaluación en memoria.
+        violations = {order.id: [] for order in self}
+        for order, line, ladder_key, tmpl_id in work:
+            ladder = ladders[ladder_key].get(tmpl_id) or {}
+            medium_price = ladder.get('medium', 0.0)
+            minimum_price = ladder.get('minimum', 0.0)
+            level_4_price = ladder.get('level_4', 0.0)
+            level_5_price = ladder.get('level_5', 0.0)
+            threshold = ladder.get(threshold_level, 0.0)
 
             requested_price = float(line.precio_unitario or 0.0)
             selector = line.x_price_selector or 'custom'
@@ -561,7 +663,7 @@ class StockLotHoldOrder(models.Model):
                     )
 
             if reason:
-                violations.append({
+                violations[order.id].append({
                     'line': line,
                     'reason': reason,
                     'requested_price': requested_price,
@@ -656,23 +758,24 @@ class StockLotHoldOrder(models.Model):
             },
         })
 
-        Product = self.env['product.template']
-        for pid_str, group in product_groups.items():
-            product = self.env['product.product'].browse(int(pid_str))
-            tmpl = product.product_tmpl_id
-
-            self.env['price.authorization.line'].create({
-                'authorization_id': auth.id,
-                'product_id': int(pid_str),
-                'quantity': group['total_quantity'],
-                'lot_count': len(group['lots']),
-                'requested_price': product_prices[pid_str],
-                'authorized_price': product_prices[pid_str],
-                'medium_price': Product._get_price_level_value(tmpl, 'medium', currency_code),
-                'minimum_price': Product._get_price_level_value(tmpl, 'minimum', currency_code),
-                'level_4_price': Product._get_price_level_value(tmpl, 'level_4', currency_code),
-                'level_5_price': Product._get_price_level_value(tmpl, 'level_5', currency_code),
-            })
+        # La escalera ya viene en cada violación (misma moneda y template):
+        # no se vuelve a leer el producto nivel por nivel.
+        ladder_by_product = {}
+        for item in violations:
+            ladder_by_product.setdefault(str(item['line'].product_id.id), item)
+
+        self.env['price.authorization.line'].create([{
+            'authorization_id': auth.id,
+            'product_id': int(pid_str),
+            'quantity': group['total_quantity'],
+            'lot_count': len(group['lots']),
+            'requested_price': product_prices[pid_str],
+            'authorized_price': product_prices[pid_str],
+            'medium_price': ladder_by_product[pid_str]['medium_price'],
+            'minimum_price': ladder_by_product[pid_str]['minimum_price'],
+            'level_4_price': ladder_by_product[pid_str]['level_4_price'],
+            'level_5_price': ladder_by_product[pid_str]['level_5_price'],
+        } for pid_str, group in product_groups.items()])
 
         self.message_post(
             body=(
@@ -683,12 +786,13 @@ class StockLotHoldOrder(models.Model):
 
         return auth
 
-    def _request_manual_hold_authorization_if_needed(self):
+    def _request_manual_hold_authorization_if_needed(self, violations=None):
         if self.env.context.get('skip_authorization_check'):
             return False
 
         self.ensure_one()
-        violations = self._get_manual_price_violations()
+        if violations is None:
+            violations = self._get_manual_price_violations()
         if not violations:
             return False
 
@@ -754,36 +858,6 @@ class StockLotHoldOrder(models.Model):
 
         return lots.exists()
 
-    def _stone_get_line_quants_for_sale_sync(self, line, lots):
-        Quant = self.env['stock.quant']
-        quants = Quant.browse()
-
-        if 'quant_id' in line._fields and line.quant_id:
-            quants |= line.quant_id
-
-        if line.product_id and lots:
-            domain = [
-                ('product_id', '=', line.product_id.id),
-                ('lot_id', 'in', lots.ids),
-                ('location_id.usage', '=', 'internal'),
-                ('quantity', '>', 0),
-            ]
-
-            # Primero busca quants que todavía estén ligados a esta reserva.
-            if 'x_hold_activo_id' in Quant._fields:
-                held_quants = Quant.search(
-                    domain + [('x_hold_activo_id', '=', self.id)],
-                    order='lot_id, id',
-                )
-                quants |= held_quants
-
-            # Fallback: si el método base libera el hold antes de terminar,
-            # recupera los quants por lote/producto.
-            all_quants = Quant.search(domain, order='lot_id, id')
-            quants |= all_quants
-
-        return quants.exists()
-
     def _stone_prepare_sale_sync_payload_from_hold(self):
         """
         Captura lotes/quants ANTES de convertir la reserva.
@@ -793,76 +867,126 @@ class StockLotHoldOrder(models.Model):
         puede distinguir qué quants pertenecían a la reserva original.
         """
         self.ensure_one()
+        return self._stone_prepare_sale_sync_payloads().get(self.id, {})
 
-        payload_by_product = defaultdict(lambda: {
-            'product_id': False,
-            'lot_ids': set(),
-            'quant_ids': set(),
-            'breakdown': {},
-        })
+    def _stone_prepare_sale_sync_payloads(self):
+        """Versión por lote de _stone_prepare_sale_sync_payload_from_hold:
+        {hold_id: payload_by_product}. Líneas, lotes y quants de TODOS los
+        apartados se cargan juntos (una sola búsqueda de quants) en lugar
+        de dos búsquedas por línea."""
+        Quant = self.env['stock.quant']
 
-        for line in self._stone_get_hold_lines_for_sale_sync():
-            if not line.product_id or line.product_id.type == 'service':
-                continue
+        lines_by_order = {}
+        lots_by_line = {}
+        all_lots = self.env['stock.lot']
+        product_ids = set()
 
-            lots = self._stone_get_line_lots_for_sale_sync(line)
-            if not lots:
-                continue
+        for order in self:
+            lines = order._stone_get_hold_lines_for_sale_sync().filtered(
+                lambda l: l.product_id and l.product_id.type != 'service'
+            )
+            lines_by_order[order.id] = lines
+            for line in lines:
+                lots = self._stone_get_line_lots_for_sale_sync(line)
+                if not lots:
+                    continue
+                lots_by_line[line.id] = lots
+                all_lots |= lots
+                product_ids.add(line.product_id.id)
+
+        # Quants internos con existencia de todos los (producto, lote). Los
+        # ligados todavía a la reserva son un subconjunto de éstos, así que
+        # basta una búsqueda; la cubeta (producto, lote) reemplaza a las dos
+        # búsquedas por línea del flujo anterior.
+        quants_by_key = defaultdict(lambda: Quant.browse())
+        if all_lots:
+            found = Quant.search([
+                ('product_id', 'in', list(product_ids)),
+                ('lot_id', 'in', all_lots.ids),
+                ('location_id.usage', '=', 'internal'),
+                ('quantity', '>', 0),
+            ], order='lot_id, id')
+            for quant in found:
+                quants_by_key[(quant.product_id.id, quant.lot_id.id)] |= quant
 
-            quants = self._stone_get_line_quants_for_sale_sync(line, lots)
-            product_id = line.product_id.id
+        payloads = {}
+        for order in self:
+            payload_by_product = defaultdict(lambda: {
+                'product_id': False,
+                'lot_ids': set(),
+                'quant_ids': set(),
+                'breakdown': {},
+            })
 
-            data = payload_by_product[product_id]
-            data['product_id'] = product_id
-            data['lot_ids'].update(lots.ids)
+            for line in lines_by_order[order.id]:
+                lots = lots_by_line.get(line.id)
+                if not lots:
+                    continue
 
-            if quants:
-                data['quant_ids'].update(quants.ids)
-                data['lot_ids'].update(quants.mapped('lot_id').ids)
+                product_id = line.product_id.id
+                quants_by_lot = {
+                    lot.id: quants_by_key[(product_id, lot.id)] for lot in lots
+                }
+                if 'quant_id' in line._fields and line.quant_id:
+                    lot_id = line.quant_id.lot_id.id
+                    quants_by_lot[lot_id] = quants_by_lot.get(lot_id, Quant.browse()) | line.quant_id
+                quants = Quant.browse()
+                for lot_quants in quants_by_lot.values():
+                    quants |= lot_quants
 
-            # Para formatos/piezas, conservar cantidad seleccionada.
-            # stone_select soporta breakdown por lot_id y algunos flujos viejos por quant_id.
-            line_breakdown = {}
-            if 'x_lot_breakdown_json' in line._fields:
-                line_breakdown = line.x_lot_breakdown_json or {}
+                data = payload_by_product[product_id]
+                data['product_id'] = product_id
+                data['lot_ids'].update(lots.ids)
 
-            for lot in lots:
-                tipo = str(getattr(lot, 'x_tipo', '') or 'placa').lower()
-                if tipo not in ('formato', 'pieza'):
-                    continue
+                if quants:
+                    data['quant_ids'].update(quants.ids)
+                    data['lot_ids'].update(quants.mapped('lot_id').ids)
+
+                # Para formatos/piezas, conservar cantidad seleccionada.
+                # stone_select soporta breakdown por lot_id y algunos flujos viejos por quant_id.
+                line_breakdown = {}
+                if 'x_lot_breakdown_json' in line._fields:
+                    line_breakdown = line.x_lot_breakdown_json or {}
+
+                for lot in lots:
+                    tipo = str(getattr(lot, 'x_tipo', '') or 'placa').lower()
+                    if tipo not in ('formato', 'pieza'):
+                        continue
 
-                qty = 0.0
+                    lot_quants = quants_by_lot.get(lot.id) or Quant.browse()
+                    qty = 0.0
 
-                # 1) Parcialidad guardada explícitamente en la línea de apartado
-                #    (lo seleccionado desde el carrito o el selector visual).
-                if str(lot.id) in line_breakdown:
-                    qty = float(line_breakdown.get(str(lot.id)) or 0.0)
+                    # 1) Parcialidad guardada explícitamente en la línea de apartado
+                    #    (lo seleccionado desde el carrito o el selector visual).
+                    if str(lot.id) in line_breakdown:
+                        qty = float(line_breakdown.get(str(lot.id)) or 0.0)
 
-                # 2) Línea de un solo lote: la cantidad de la línea ES la del lote.
-                if qty <= 0 and len(lots) == 1 and 'cantidad_m2' in line._fields:
-                    qty = float(line.cantidad_m2 or 0.0)
+                    # 2) Línea de un solo lote: la cantidad de la línea ES la del lote.
+                    if qty <= 0 and len(lots) == 1 and 'cantidad_m2' in line._fields:
+                        qty = float(line.cantidad_m2 or 0.0)
 
-                # 3) Último recurso: cantidad del quant (lote completo).
-                if qty <= 0 and quants:
-                    lot_quants = quants.filtered(lambda q: q.lot_id.id == lot.id)
-                    qty = sum(lot_quants.mapped('quantity')) if lot_quants else 0.0
+                    # 3) Último recurso: cantidad del quant (lote completo).
+                    if qty <= 0 and lot_quants:
+                        qty = sum(lot_quants.mapped('quantity'))
 
-                if qty > 0:
-                    data['breakdown'][str(lot.id)] = qty
+                    if qty > 0:
+                        data['breakdown'][str(lot.id)] = qty
 
-                    for quant in quants.filtered(lambda q: q.lot_id.id == lot.id):
-                        data['breakdown'][str(quant.id)] = qty
+                        for quant in lot_quants:
+                            data['breakdown'][str(quant.id)] = qty
 
-        return {
-            product_id: {
-                'product_id': values['product_id'],
-                'lot_ids': list(values['lot_ids']),
-                'quant_ids': list(values['quant_ids']),
-                'breakdown': values['breakdown'],
+            payloads[order.id] = {
+                product_id: {
+                    'product_id': values['product_id'],
+                    'lot_ids': list(values['lot_ids']),
+                    'quant_ids': list(values['quant_ids']),
+                    'breakdown': values['breakdown'],
+                }
+                for product_id, values in payload_by_product.items()
+                if values['lot_ids']
             }
-            for product_id, values in payload_by_product.items()
-            if values['lot_ids']
-        }
+
+        return payloads
 
     def _stone_resolve_sale_order_from_convert_result(self, result=None):
         self.ensure_one()
@@ -884,6 +1008,22 @@ class StockLotHoldOrder(models.Model):
         if not sale_order or not payload_by_product:
             return
 
+        pending = {}
+        self._stone_collect_hold_payload_line_vals(sale_order, payload_by_product, pending)
+        self._stone_write_hold_payload_line_vals(pending)
+
+        if sale_order.state in ('sale', 'done') and hasattr(sale_order, '_sync_lot_ids_from_selected_lots'):
+            sale_order.sudo().with_context(
+                skip_hold_validation=True,
+            )._sync_lot_ids_from_selected_lots()
+
+    @api.model
+    def _stone_collect_hold_payload_line_vals(self, sale_order, payload_by_product, pending):
+        """Acumula en `pending` ({línea SO: selección}) lo que cada producto
+        del payload debe escribir en su línea de venta, SIN escribir todavía.
+        Varias reservas convertidas a la misma SO se reparten entre líneas
+        libres; si dos caen en la misma línea, sus selecciones se unen (antes
+        la segunda escritura (6, 0) pisaba a la primera)."""
         for product_id, payload in payload_by_product.items():
             sale_lines = sale_order.order_line.filtered(
                 lambda l:
@@ -899,47 +1039,75 @@ class StockLotHoldOrder(models.Model):
                 )
                 continue
 
-            target_line = sale_lines.filtered(
+            free_lines = sale_lines.filtered(
                 lambda l:
                     ('lot_ids' not in l._fields or not l.lot_ids)
                     and ('x_selected_lots' not in l._fields or not l.x_selected_lots)
-            )[:1] or sale_lines[:1]
+            )
+            target_line = (
+                free_lines.filtered(lambda l: l not in pending)[:1]
+                or free_lines[:1]
+                or sale_lines[:1]
+            )
+
+            selection = pending.setdefault(target_line, {
+                'quant_ids': set(),
+                'lot_ids': set(),
+                'breakdown': {},
+            })
+            selection['quant_ids'].update(payload.get('quant_ids') or [])
+            selection['lot_ids'].update(payload.get('lot_ids') or [])
+            selection['breakdown'].update(payload.get('breakdown') or {})
+
+    @api.model
+    def _stone_write_hold_payload_line_vals(self, pending):
+        """Escribe la selección acumulada: una escritura por grupo de líneas
+        con valores idénticos (y a lo más una por línea)."""
+        groups = defaultdict(lambda: self.env['sale.order.line'])
+        vals_by_key = {}
 
+        for line, selection in pending.items():
             vals = {}
+            key = []
 
             # x_selected_lots puede escribirse aun si la SO queda como cotización.
             # Después, action_confirm de sale.order lo convierte a lot_ids.
-            if 'x_selected_lots' in target_line._fields and payload.get('quant_ids'):
-                vals['x_selected_lots'] = [(6, 0, payload['quant_ids'])]
+            if 'x_selected_lots' in line._fields and selection['quant_ids']:
+                quant_ids = sorted(selection['quant_ids'])
+                vals['x_selected_lots'] = [(6, 0, quant_ids)]
+                key.append(('x_selected_lots', tuple(quant_ids)))
 
             # lot_ids solo se escribe si la SO ya está confirmada.
             # sale_stone_selection bloquea selección de lotes en cotización.
-            if sale_order.state in ('sale', 'done'):
-                if 'lot_ids' in target_line._fields and payload.get('lot_ids'):
-                    vals['lot_ids'] = [(6, 0, payload['lot_ids'])]
+            if line.order_id.state in ('sale', 'done'):
+                if 'lot_ids' in line._fields and selection['lot_ids']:
+                    lot_ids = sorted(selection['lot_ids'])
+                    vals['lot_ids'] = [(6, 0, lot_ids)]
+                    key.append(('lot_ids', tuple(lot_ids)))
 
-                if 'x_lot_breakdown_json' in target_line._fields and payload.get('breakdown'):
-                    vals['x_lot_breakdown_json'] = payload['breakdown']
+                if 'x_lot_breakdown_json' in line._fields and selection['breakdown']:
+                    vals['x_lot_breakdown_json'] = selection['breakdown']
+                    key.append(('breakdown', tuple(sorted(selection['breakdown'].items()))))
 
             if vals:
-                # Los lotes vienen del PROPIO hold que se está convirtiendo:
-                # validarlos contra su propio apartado sería auto-bloqueo.
-                target_line.sudo().with_context(
-                    skip_hold_validation=True,
-                ).write(vals)
-
-                _logger.info(
-                    "[HOLD→STONE] SO %s línea %s sincronizada: lots=%s quants=%s",
-                    sale_order.name,
-                    target_line.id,
-                    len(payload.get('lot_ids') or []),
-                    len(payload.get('quant_ids') or []),
-                )
-
-        if sale_order.state in ('sale', 'done') and hasattr(sale_order, '_sync_lot_ids_from_selected_lots'):
-            sale_order.sudo().with_context(
+                key = tuple(key)
+                groups[key] |= line
+                vals_by_key[key] = vals
+
+        for key, lines in groups.items():
+            vals = vals_by_key[key]
+            # Los lotes vienen del PROPIO hold que se está convirtiendo:
+            # validarlos contra su propio apartado sería auto-bloqueo.
+            lines.sudo().with_context(
                 skip_hold_validation=True,
-            )._sync_lot_ids_from_selected_lots()
+            ).write(vals)
+
+            _logger.info(
+                "[HOLD→STONE] Líneas SO %s sincronizadas: lots=%s quants=%s",
+                lines.ids,
+                len(vals.get('lot_ids', [(6, 0, [])])[0][2]),
+                len(vals.get('x_selected_lots', [(6, 0, [])])[0][2]),
+            )
 
     @staticmethod
     def _hold_line_is_backorder(line):
@@ -995,8 +1163,15 @@ class StockLotHoldOrder(models.Model):
         self._sync_manual_defaults_and_lines()
         self._assert_material_lines_have_placas()
 
+        # Política de precios de todos los apartados en una sola pasada.
+        violations_by_order = {}
+        if not self.env.context.get('skip_authorization_check'):
+            violations_by_order = self._get_manual_price_violations_batch()
+
         for order in self:
-            action = order._request_manual_hold_authorization_if_needed()
+            action = order._request_manual_hold_authorization_if_needed(
+                violations=violations_by_order.get(order.id, []),
+            )
             if action:
                 return action
 
@@ -1050,18 +1225,16 @@ class StockLotHoldOrder(models.Model):
         4. Copia quants a x_selected_lots.
         5. Si la SO ya quedó confirmada, también copia lotes a lot_ids.
         """
-        payload_by_order = {
-            order.id: order._stone_prepare_sale_sync_payload_from_hold()
-            for order in self
-        }
+        payload_by_order = self._stone_prepare_sale_sync_payloads()
 
         result = super().action_convert_to_sale_order()
 
-        for order in self:
-            order.invalidate_recordset()
+        # Una sola invalidación para todo el lote (antes, una por orden).
+        self.invalidate_recordset()
 
+        sale_by_order = {}
+        for order in self:
             sale_order = order._stone_resolve_sale_order_from_convert_result(result)
-            payload = payload_by_order.get(order.id) or {}
 
             if not sale_order:
                 _logger.warning(
@@ -1070,7 +1243,30 @@ class StockLotHoldOrder(models.Model):
                 )
                 continue
 
-            order._stone_apply_hold_payload_to_sale_order(sale_order, payload)
+            sale_by_order[order] = sale_order
+
+        # Prefetch compartido de las líneas de todas las SO creadas.
+        # Varias reservas pueden caer en la MISMA SO: ids sin repetir.
+        sale_orders = self.env['sale.order'].browse(
+            sorted({so.id for so in sale_by_order.values()})
+        )
+        sale_orders.order_line.fetch(['product_id', 'display_type'])
+
+        # Selección de TODAS las reservas acumulada por línea de venta y
+        # escrita en grupos de valores idénticos.
+        pending = {}
+        for order, sale_order in sale_by_order.items():
+            self._stone_collect_hold_payload_line_vals(
+                sale_order, payload_by_order.get(order.id) or {}, pending,
+            )
+        self._stone_write_hold_payload_line_vals(pending)
+
+        # lot_ids desde x_selected_lots: una pasada para todas las SO confirmadas.
+        confirmed = sale_orders.filtered(lambda so: so.state in ('sale', 'done'))
+        if confirmed and hasattr(confirmed, '_sync_lot_ids_from_selected_lots'):
+            confirmed.sudo().with_context(
+                skip_hold_validation=True,
+            )._sync_lot_ids_from_selected_lots()
 
         return result
 
@@ -1098,12 +1294,153 @@ class StockLotHoldOrder(models.Model):
 
         res = super().action_renew()
 
-        # super() ya validó el estado y renovó los holds; contamos la renovación.
+        # super() ya validó el estado y renovó los holds; contamos la
+        # renovación con un write por cada conteo distinto, no uno por orden.
+        by_count = defaultdict(lambda: self.browse())
         for order in self:
-            order.x_renew_count += 1
+            by_count[order.x_renew_count] |= order
+        for count, orders in by_count.items():
+            orders.write({'x_renew_count': count + 1})
 
         return res
 
+    def action_bulk_renew(self):
+        """Renovación masiva desde la lista: renueva de una sola pasada los
+        apartados seleccionados que se pueden revivir y reporta los que no
+        (sin SO, confirmados y, para vendedores, sin renovación previa)."""
+        is_authorizer = self.env.user.has_group(
+            'inventory_shopping_cart.group_price_authorizer'
+        )
+        renewable = self.filtered(
+            lambda o: o.state == 'confirmed'
+            and not o.sale_order_id
+            and (is_authorizer or o.x_renew_count < 1)
+        )
+        skipped = self - renewable
+
+        if renewable:
+            renewable.action_renew()
+
+        message = '%s apartado(s) renovado(s).' % len(renewable)
+        if skipped:
+            message += ' Omitidos (%s): %s' % (
+                len(skipped), ', '.join(skipped[:20].mapped('name')))
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Renovación de apartados',
+                'message': message,
+                'type': 'success' if not skipped else 'warning',
+                'sticky': bool(skipped),
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+
+    # -------------------------------------------------------------------------
+    # Vencimiento masivo
+    # -------------------------------------------------------------------------
+    @api.model
+    def _cron_som_expire_holds(self, batch_size=500):
+        """Cancela por bloques los apartados confirmados vencidos (sin SO).
+        Si quedan más que batch_size, se vuelve a disparar a sí mismo en
+        lugar de alargar la transacción."""
+        domain = [
+            ('state', '=', 'confirmed'),
+            ('fecha_expiracion', '!=', False),
+            ('fecha_expiracion', '<=', fields.Datetime.now()),
+            ('sale_order_id', '=', False),
+        ]
+        expired = self.search(domain, order='fecha_expiracion, id', limit=batch_size + 1)
+        if not expired:
+            return
+
+        more = len(expired) > batch_size
+        expired = expired[:batch_size]
+        expired._som_expire_holds()
+
+        _logger.info("[HOLD-EXPIRY] %s apartado(s) vencido(s) cancelado(s).", len(expired))
+
+        if more:
+            self.env.cr.commit()
+            cron = self.env.ref(
+                'inventory_shopping_cart.ir_cron_som_expire_holds',
+                raise_if_not_found=False)
+            if cron:
+                cron.sudo()._trigger()
+
+    def _som_expire_holds(self):
+        """Vence este recordset completo de una vez:
+          1. Una búsqueda para los quants que siguen ligados a estos apartados.
+          2. Un solo action_cancel del base sobre todo el recordset.
+          3. Limpieza agrupada de los quants que el base no haya soltado.
+          4. Nota en el chatter por lote y UN envío de bus por vendedor."""
+        if not self:
+            return
+
+        Quant = self.env['stock.quant'].sudo()
+        held_quants = Quant.browse()
+        if 'x_hold_activo_id' in Quant._fields:
+            held_quants = Quant.search([('x_hold_activo_id', 'in', self.ids)])
+
+        self.with_context(
+            tracking_disable=True,
+            skip_hold_order_sync=True,
+            skip_hold_line_quantity_sync=True,
+            skip_hold_line_price_sync=True,
+        ).action_cancel()
+
+        # Solo si el vínculo del quant es un campo almacenado "plano"; si el
+        # base lo calcula, ya se recalculó al cancelar.
+        field = Quant._fields.get('x_hold_activo_id')
+        if held_quants and field and field.store and not field.compute:
+            stale = held_quants.filtered(lambda q: q.x_hold_activo_id in self)
+            if stale:
+                vals = {'x_hold_activo_id': False}
+                tiene_hold = Quant._fields.get('x_tiene_hold')
+                if tiene_hold and tiene_hold.store and not tiene_hold.compute:
+                    vals['x_tiene_hold'] = False
+                stale.write(vals)
+
+        if hasattr(self, '_message_log_batch'):
+            self._message_log_batch(bodies={
+                order.id: 'Apartado vencido el %s: material liberado automáticamente.' % (
+                    fields.Datetime.to_string(order.fecha_expiracion))
+                for order in self
+            })
+
+        self._som_notify_expired_holds()
+
+    def _som_notify_expired_holds(self):
+        """Un aviso por vendedor con todos sus apartados vencidos. _sendone
+        solo encola: el bus los despacha juntos al hacer commit. Cosmético:
+        nunca tumba el vencimiento."""
+        by_user = defaultdict(lambda: self.browse())
+        for order in self:
+            if order.user_id and order.user_id.partner_id:
+                by_user[order.user_id] |= order
+
+        Bus = self.env['bus.bus'].sudo()
+        for user, orders in by_user.items():
+            names = ', '.join(orders[:20].mapped('name'))
+            if len(orders) > 20:
+                names += '…'
+            try:
+                Bus._sendone(user.partner_id, 'simple_notification', {
+                    'type': 'warning',
+                    'sticky': True,
+                    'title': 'Apartados vencidos',
+                    'message': (
+                        'Se liberaron %s apartado(s) por vencimiento: %s'
+                        % (len(orders), names)),
+                })
+            except Exception:
+                _logger.warning(
+                    "[HOLD-EXPIRY] No se pudo avisar por bus a %s.",
+                    user.name, exc_info=True,
+                )
+
 
 class StockLotHoldOrderLine(models.Model):
     _inherit = 'stock.lot.hold.order.line'
@@ -1124,6 +1461,10 @@ class StockLotHoldOrderLine(models.Model):
     def _compute_x_utilidad(self):
         company = self.env.company
         today = fields.Date.context_today(self)
+        # Una tasa por moneda destino para todo el recordset (misma tasa que
+        # _convert: compañía y fecha son fijas aquí), en lugar de consultar
+        # las tasas línea por línea.
+        rates = {}
         for line in self:
             cost_unit = 0.0
             if line.product_id:
@@ -1132,8 +1473,10 @@ class StockLotHoldOrderLine(models.Model):
             cost_total = (line.cantidad_m2 or 0.0) * cost_unit
             cur = line.currency_id or company.currency_id
             if cur and company.currency_id and cur != company.currency_id:
-                cost_total = company.currency_id._convert(
-                    cost_total, cur, company, today)
+                if cur not in rates:
+                    rates[cur] = self.env['res.currency']._get_conversion_rate(
+                        company.currency_id, cur, company, today)
+                cost_total = cur.round(cost_total * rates[cur])
             line.x_utilidad = (line.precio_total or 0.0) - cost_total
 
     x_price_selector = fields.Selection([
@@ -1249,6 +1592,15 @@ class StockLotHoldOrderLine(models.Model):
              '(mapeados por la posición fiscal del cliente).',
     )
 
+    x_untaxed_amount = fields.Monetary(
+        string='Subtotal sin impuestos',
+        compute='_compute_x_tax_amount',
+        store=True,
+        currency_field='currency_id',
+        help='Base de la línea (total sin impuestos) según compute_all; la '
+             'suman los totales del apartado.',
+    )
+
     @api.depends(
         'product_id',
         'product_id.taxes_id',
@@ -1260,31 +1612,55 @@ class StockLotHoldOrderLine(models.Model):
         'order_id.company_id',
     )
     def _compute_x_tax_amount(self):
+        """Impuesto y base de la línea, UNA vez por línea.
+
+        Los impuestos de venta del producto se filtran por compañía y se
+        mapean por la posición fiscal una sola vez por combinación (impuestos
+        del producto, compañía, posición fiscal), y compute_all se memoriza
+        por (impuestos, moneda, precio, cantidad, producto, cliente): líneas
+        idénticas del recordset no repiten la cuenta."""
+        AccountTax = self.env['account.tax']
+        mapped_taxes = {}
+        results = {}
+
         for line in self:
             qty = line.cantidad_m2 or 0.0
             price = line.precio_unitario or 0.0
             company = line.order_id.company_id or self.env.company
             currency = line.currency_id or company.currency_id
+            partner = line.order_id.partner_id
 
-            taxes = self.env['account.tax']
+            taxes = AccountTax
             if line.product_id:
-                taxes = line.product_id.taxes_id.filtered(
-                    lambda t: t.company_id == company
-                )
-                fpos = line.order_id.partner_id.property_account_position_id
-                if fpos:
-                    taxes = fpos.map_tax(taxes)
+                fpos = partner.property_account_position_id
+                taxes_key = (tuple(line.product_id.taxes_id.ids), company.id, fpos.id)
+                if taxes_key not in mapped_taxes:
+                    taxes = line.product_id.taxes_id.filtered(
+                        lambda t: t.company_id == company
+                    )
+                    if fpos:
+                        taxes = fpos.map_tax(taxes)
+                    mapped_taxes[taxes_key] = taxes
+                taxes = mapped_taxes[taxes_key]
 
             if taxes and qty and price:
-                res = taxes.compute_all(
-                    price,
-                    currency=currency,
-                    quantity=qty,
-                    product=line.product_id,
-                    partner=line.order_id.partner_id,
-                )
-                line.x_tax_amount = res['total_included'] - res['total_excluded']
+                result_key = (tuple(taxes.ids), currency.id, price, qty,
+                              line.product_id.id, partner.id)
+                if result_key not in results:
+                    res = taxes.compute_all(
+                        price,
+                        currency=currency,
+                        quantity=qty,
+                        product=line.product_id,
+                        partner=partner,
+                    )
+                    results[result_key] = (
+                        res['total_excluded'],
+                        res['total_included'] - res['total_excluded'],
+                    )
+                line.x_untaxed_amount, line.x_tax_amount = results[result_key]
             else:
+                line.x_untaxed_amount = qty * price
                 line.x_tax_amount = 0.0
 
     @api.depends_context('uid')
@@ -1389,7 +1765,16 @@ class StockLotHoldOrderLine(models.Model):
               se toma la cantidad completa del quant, igual que el base.
         - Servicio: 1.0 por defecto si está vacío.
         - Material adicional (físico sin placas): se conserva lo capturado.
+
+        El stock interno de TODOS los lotes de TODAS las líneas sale de una
+        sola lectura agrupada (_som_internal_qty_by_lot).
         """
+        full_lots = self.env['stock.lot']
+        for line in self:
+            breakdown = line.x_lot_breakdown_json or {}
+            full_lots |= line.lot_ids.filtered(lambda lot: str(lot.id) not in breakdown)
+        internal_qty = self._som_internal_qty_by_lot(full_lots)
+
         for line in self:
             if line.lot_ids:
                 breakdown = line.x_lot_breakdown_json or {}
@@ -1400,12 +1785,7 @@ class StockLotHoldOrderLine(models.Model):
                         # Parcialidad explícita seleccionada para este lote.
                         total += float(breakdown.get(key) or 0.0)
                         continue
-                    quants = self.env['stock.quant'].search([
-                        ('lot_id', '=', lot.id),
-                        ('quantity', '>', 0),
-                        ('location_id.usage', '=', 'internal'),
-                    ])
-                    total += sum(quants.mapped('quantity'))
+                    total += internal_qty.get(lot.id, 0.0)
                 line.cantidad_m2 = total
             elif line.product_id and line.product_id.type == 'service':
                 if not line.cantidad_m2:
@@ -1504,80 +1884,97 @@ class StockLotHoldOrderLine(models.Model):
                         'precio_unitario': price,
                     })
 
-    @api.model
-    def get_available_stone_quants(self, product_id, hold_order_id=False,
-                                   lot_name=False, location_name=False, limit=500):
-        """Placas seleccionables para el selector del apartado.
-
-        Excluye exactamente lo que `_assert_quants_can_be_used` rechazaría al
-        convertir la reserva en SO, para no ofrecer placas ya comprometidas:
-        - Lotes con reserva nativa activa en otra SO / orden de entrega.
-        - Lotes en un hold activo distinto al que se está editando.
-
-        Devuelve la misma forma que el `search_read` anterior (lot_id y
-        location_id como [id, nombre]) para no romper el render del widget.
-        """
-        if not product_id:
-            return []
-
-        Quant = self.env['stock.quant'].sudo()
-        SaleOrder = self.env['sale.order']
+    # Filtros del selector de placas: texto (ilike) y mínimos numéricos.
+    _STONE_TEXT_FILTERS = {
+        'lot_name': 'lot_id.name',
+        'location_name': 'location_id.complete_name',
+        'bloque': 'x_bloque',
+        'atado': 'x_atado',
+    }
+    _STONE_MIN_FILTERS = {
+        'alto_min': 'x_alto',
+        'ancho_min': 'x_ancho',
+        'grosor_min': 'x_grosor',
+    }
 
+    @api.model
+    def _som_stone_quant_domain(self, product_id, filters=None):
+        """Dominio de placas candidatas con los filtros del selector
+        aplicados EN EL SERVIDOR (los que el quant no soporta se ignoran)."""
+        Quant = self.env['stock.quant']
+        filters = filters or {}
         domain = [
-            ('product_id', '=', product_id),
+            ('product_id', '=', int(product_id)),
             ('location_id.usage', '=', 'internal'),
             ('quantity', '>', 0),
+            ('lot_id', '!=', False),
         ]
-        if lot_name:
-            domain.append(('lot_id.name', 'ilike', lot_name))
-        if location_name:
-            domain.append(('location_id.complete_name', 'ilike', location_name))
-
-        quants = Quant.search(domain, limit=limit, order='lot_id')
-
-        # LOTES COMPROMETIDOS (ventas confirmadas, entregas, taller, carrito):
-        # fuera del selector de apartados por completo. La reserva nativa NO
-        # basta como filtro — las líneas gestionadas por Torre de Control
-        # omiten el FIFO a propósito y sus lotes quedan comprometidos con
-        # reserved_quantity = 0. Los lotes del PROPIO apartado en edición se
-        # permiten (para poder verlo/ajustarlo).
-        committed_lot_ids = set(Quant._get_committed_lot_ids(int(product_id)))
-        if hold_order_id:
-            own_hold = self.browse(int(hold_order_id)).exists()
-            if own_hold:
-                own_lots = set()
-                if 'lot_ids' in own_hold._fields and own_hold.lot_ids:
-                    own_lots.update(own_hold.lot_ids.ids)
-                for line in getattr(own_hold, 'line_ids', []):
-                    if getattr(line, 'lot_id', False):
-                        own_lots.add(line.lot_id.id)
-                committed_lot_ids -= own_lots
-
-        available = Quant.browse()
-        for quant in quants:
-            if not quant.lot_id:
+        for key, path in self._STONE_TEXT_FILTERS.items():
+            value = (filters.get(key) or '').strip()
+            root = path.split('.')[0]
+            if value and root in Quant._fields \
+                    and getattr(Quant._fields[root], '_description_searchable', True):
+                domain.append((path, 'ilike', value))
+        for key, fname in self._STONE_MIN_FILTERS.items():
+            field = Quant._fields.get(fname)
+            value = filters.get(key)
+            if value in (None, '', False) or not field \
+                    or field.type not in ('float', 'integer', 'monetary') \
+                    or not getattr(field, '_description_searchable', True):
                 continue
-
-            if quant.lot_id.id in committed_lot_ids:
+            try:
+                domain.append((fname, '>=', float(value)))
+            except (TypeError, ValueError):
                 continue
+        return domain
 
-            # Hold activo de OTRA reserva: la placa ya está apartada.
-            # APARTADO PARCIAL: si el hold solo retiene su parcialidad
-            # (formato/pieza), el remanente sí se ofrece — el tope por
-            # lo libre (som_free_qty) descuenta lo retenido.
-            if getattr(quant, 'x_tiene_hold', False) and quant.x_hold_activo_id:
-                if not hold_order_id or quant.x_hold_activo_id.id != hold_order_id:
-                    if not hasattr(quant, 'som_hold_blocks_fully') \
-                            or quant.som_hold_blocks_fully():
-                        continue
+    @api.model
+    def _som_own_hold_lot_ids(self, hold_order_id):
+        """Lotes del apartado en edición (se permiten en su propio selector)."""
+        own_lot_ids = set()
+        own_hold = self.env['stock.lot.hold.order'].browse(hold_order_id).exists() \
+            if hold_order_id else False
+        if own_hold:
+            if 'lot_ids' in own_hold._fields:
+                own_lot_ids.update(own_hold.lot_ids.ids)
+            for line in own_hold.line_ids:
+                if line.lot_id:
+                    own_lot_ids.add(line.lot_id.id)
+                own_lot_ids.update(line.lot_ids.ids)
+        return own_lot_ids
 
-            # Reserva nativa activa en otra SO / entrega. Solo puede existir si el
-            # quant tiene cantidad reservada, así evitamos una búsqueda por placa libre.
-            if quant.reserved_quantity > 0 and SaleOrder._get_native_reservation_blockers(quant):
-                continue
+    @api.model
+    def _som_available_stone_quants(self, quants, hold_order_id, own_lot_ids, committed_lot_ids):
+        """Excluye del recordset exactamente lo que `_assert_quants_can_be_used`
+        rechazaría, todo por CONJUNTO (nada de búsquedas por placa)."""
+        Quant = self.env['stock.quant']
+        candidates = quants.filtered(
+            lambda q: q.lot_id and q.lot_id.id not in committed_lot_ids
+        )
 
-            available |= quant
+        # Hold activo de OTRA reserva: la placa ya está apartada.
+        # APARTADO PARCIAL: si el hold solo retiene su parcialidad
+        # (formato/pieza), el remanente sí se ofrece — el tope por
+        # lo libre (som_free_qty) descuenta lo retenido.
+        if 'x_tiene_hold' in Quant._fields:
+            foreign_held = candidates.filtered(
+                lambda q: q.x_tiene_hold and q.x_hold_activo_id
+                and q.x_hold_activo_id.id != hold_order_id
+            )
+            if hasattr(Quant, 'som_hold_blocks_fully'):
+                foreign_held = foreign_held.filtered(lambda q: q.som_hold_blocks_fully())
+            candidates -= foreign_held
 
+        # Reserva nativa activa en otra SO / entrega. Solo puede existir si el
+        # quant tiene cantidad reservada; una sola búsqueda para todos.
+        reserved = candidates.filtered(lambda q: q.reserved_quantity > 0)
+        return candidates - self.env['sale.order']._get_native_reservation_blocked_quants(reserved)
+
+    @api.model
+    def _som_stone_quant_rows(self, available, own_lot_ids):
+        """Filas para el widget (lot_id y location_id como [id, nombre]) con
+        su cantidad LIBRE (som_free_qty)."""
+        Quant = self.env['stock.quant']
         optional_fields = [
             'x_bloque', 'x_atado', 'x_alto', 'x_ancho', 'x_grosor', 'x_tipo', 'x_color',
         ]
@@ -1592,87 +1989,200 @@ class StockLotHoldOrderLine(models.Model):
         # formato con parte asignada a un pedido se ofrecía por su físico
         # completo y el apartado rebasaba el material real.
         Line = self.env['stock.lot.hold.order.line']
-        if hasattr(Line, '_som_lot_free_qty'):
-            free_left = {}
-            filtered = []
-            own_lot_ids = set()
-            if hold_order_id:
-                own = self.browse(int(hold_order_id)).exists()
-                if own:
-                    for ln in getattr(own, 'line_ids', []):
-                        own_lot_ids.update(ln.lot_ids.ids)
-            for row in rows:
-                lot_id = row['lot_id'][0] if row.get('lot_id') else 0
-                if not lot_id:
-                    continue
-                if lot_id not in free_left:
-                    lot = self.env['stock.lot'].browse(lot_id)
-                    free_left[lot_id] = Line._som_lot_free_qty(lot)[2]
-                # Los lotes del propio apartado en edición se ofrecen por su
-                # físico (su cantidad ya está tomada por esta misma orden).
-                if lot_id in own_lot_ids:
-                    row['som_free_qty'] = row.get('quantity') or 0.0
-                    filtered.append(row)
-                    continue
-                row_free = min(row.get('quantity') or 0.0, free_left[lot_id])
-                if row_free <= 0.0001:
-                    continue
-                free_left[lot_id] -= row_free
-                row['som_free_qty'] = row_free
+        if not hasattr(Line, '_som_lot_free_qty'):
+            return rows
+
+        # Los lotes se recorren como UN recordset para que su prefetch
+        # sea compartido entre todas las consultas de libre.
+        lots = available.lot_id.filtered(lambda lot: lot.id not in own_lot_ids)
+        free_left = {lot.id: Line._som_lot_free_qty(lot)[2] for lot in lots}
+        filtered = []
+        for row in rows:
+            lot_id = row['lot_id'][0] if row.get('lot_id') else 0
+            if not lot_id:
+                continue
+            # Los lotes del propio apartado en edición se ofrecen por su
+            # físico (su cantidad ya está tomada por esta misma orden).
+            if lot_id in own_lot_ids:
+                row['som_free_qty'] = row.get('quantity') or 0.0
                 filtered.append(row)
-            return filtered
+                continue
+            row_free = min(row.get('quantity') or 0.0, free_left[lot_id])
+            if row_free <= 0.0001:
+                continue
+            free_left[lot_id] -= row_free
+            row['som_free_qty'] = row_free
+            filtered.append(row)
+        return filtered
 
-        return rows
+    @api.model
+    def get_available_stone_quants_page(self, product_id, hold_order_id=False,
+                                        filters=None, cursor=False, page_size=200):
+        """Página del selector de placas con paginación por CURSOR (keyset).
+
+        Se pagina por LOTE en orden de id (estable e indexado): el cursor es
+        el id del último lote recorrido y la siguiente página arranca justo
+        después, sin OFFSET. Una página nunca parte un lote (el libre del
+        lote se reparte entre sus quants). Como el filtrado de
+        disponibilidad descarta filas, se recorren lotes hasta juntar
+        `page_size` filas ofrecibles.
+
+        Devuelve {'records', 'next_cursor' (False al final), 'total'}.
+        'total' son LOTES CANDIDATOS (filtros aplicados, sin los lotes
+        comprometidos; las reservas/holds ajenos se descartan después, por
+        placa) y solo se calcula en la primera página (sin cursor); en las
+        siguientes viene en False y el widget conserva el de la primera.
+        """
+        if not product_id:
+            return {'records': [], 'next_cursor': False, 'total': 0}
 
-    def _get_quantity_from_lots(self):
-        self.ensure_one()
+        Quant = self.env['stock.quant'].sudo()
+        Lot = self.env['stock.lot'].sudo()
+        hold_order_id = int(hold_order_id) if hold_order_id else False
+        page_size = max(1, min(int(page_size or 200), 1000))
+
+        # El nombre de lote se filtra sobre stock_lot DIRECTO (índice
+        # trigram de stock_lot.name) en lugar de vía lot_id.name desde el
+        # quant; el resto de los filtros viven en el dominio del quant.
+        filters = dict(filters or {})
+        lot_name = (filters.pop('lot_name', False) or '').strip()
+        domain = self._som_stone_quant_domain(product_id, filters)
+        lot_domain = [('product_id', '=', int(product_id))]
+        if lot_name:
+            lot_domain.append(('name', 'ilike', lot_name))
+        lot_domain.append(('quant_ids', 'any', domain))
+        own_lot_ids = self._som_own_hold_lot_ids(hold_order_id)
+        # LOTES COMPROMETIDOS (ventas confirmadas, entregas, taller, carrito):
+        # fuera del selector de apartados por completo. La reserva nativa NO
+        # basta como filtro — las líneas gestionadas por Torre de Control
+        # omiten el FIFO a propósito y sus lotes quedan comprometidos con
+        # reserved_quantity = 0.
+        committed_lot_ids = set(Quant._get_committed_lot_ids(int(product_id))) - own_lot_ids
+
+        records = []
+        # Primera página: los lotes del propio apartado van siempre, estén en
+        # la página que estén, para que su selección actual se vea completa.
+        if not cursor and own_lot_ids:
+            own_quants = Quant.search(domain + [
+                ('lot_id', 'in', Lot.search(lot_domain + [('id', 'in', list(own_lot_ids))]).ids),
+            ], order='id')
+            own_quants = self._som_available_stone_quants(
+                own_quants, hold_order_id, own_lot_ids, committed_lot_ids)
+            records += self._som_stone_quant_rows(own_quants, own_lot_ids)
+        seen_quant_ids = {row['id'] for row in records}
+
+        last_lot_id = int(cursor) if cursor else 0
+        exhausted = False
+        while len(records) < page_size and not exhausted:
+            lots = Lot.search(
+                lot_domain + [('id', '>', last_lot_id)], limit=page_size, order='id')
+            exhausted = len(lots) < page_size
+            if not lots:
+                break
+            last_lot_id = lots[-1].id
+
+            quants = Quant.search(domain + [('lot_id', 'in', lots.ids)], order='id')
+            available = self._som_available_stone_quants(
+                quants, hold_order_id, own_lot_ids, committed_lot_ids)
+            records += [
+                row for row in self._som_stone_quant_rows(available, own_lot_ids)
+                if row['id'] not in seen_quant_ids
+            ]
 
-        lots = self.env['stock.lot']
+        return {
+            'records': records,
+            'next_cursor': False if exhausted else last_lot_id,
+            'total': False if cursor else Lot.search_count(
+                lot_domain + [('id', 'not in', list(committed_lot_ids))]),
+        }
 
-        if self.lot_ids:
-            lots |= self.lot_ids
+    @api.model
+    def get_available_stone_quants(self, product_id, hold_order_id=False,
+                                   lot_name=False, location_name=False, limit=500):
+        """Placas seleccionables para el selector del apartado (primera
+        página de get_available_stone_quants_page, para consumidores viejos).
 
-        if self.lot_id:
-            lots |= self.lot_id
+        Excluye exactamente lo que `_assert_quants_can_be_used` rechazaría al
+        convertir la reserva en SO, para no ofrecer placas ya comprometidas:
+        - Lotes con reserva nativa activa en otra SO / orden de entrega.
+        - Lotes en un hold activo distinto al que se está editando.
+
+        Devuelve la misma forma que el `search_read` anterior (lot_id y
+        location_id como [id, nombre]) para no romper el render del widget.
+        """
+        return self.get_available_stone_quants_page(
+            product_id, hold_order_id,
+            filters={'lot_name': lot_name, 'location_name': location_name},
+            page_size=limit,
+        )['records']
+
+    @api.model
+    def _som_internal_qty_by_lot(self, lots):
+        """Stock interno (> 0) de varios lotes en UNA lectura agrupada:
+        {lot_id: cantidad}."""
+        if not lots:
+            return {}
+        groups = self.env['stock.quant'].sudo()._read_group(
+            [
+                ('lot_id', 'in', lots.ids),
+                ('location_id.usage', '=', 'internal'),
+                ('quantity', '>', 0),
+            ],
+            ['lot_id'],
+            ['quantity:sum'],
+        )
+        return {lot.id: qty for lot, qty in groups}
 
+    def _get_quantities_from_lots(self):
+        """Cantidad a apartar de cada línea del recordset según sus lotes:
+        {line.id: cantidad}. Los lotes de todas las líneas se resuelven
+        juntos (cada lote una sola vez)."""
         # Con desglose de parcialidades (FORMATOS/PIEZAS) se respeta la cantidad
         # parcial por lote; los lotes sin entrada en el desglose usan TODO su
         # stock interno. Así el guardado no pisa la parcialidad seleccionada.
-        breakdown = {}
-        if 'x_lot_breakdown_json' in self._fields:
-            breakdown = self.x_lot_breakdown_json or {}
-
-        if lots:
-            # La cantidad SIEMPRE es la suma de lo seleccionado por lote.
-            # quant_id es solo un legacy del PRIMER lote: darle prioridad
-            # dejaba la cantidad igual a los m² de una sola placa arbitraria
-            # al editar la línea (el "número de la nada").
-            total = 0.0
-            for lot in lots:
-                key = str(lot.id)
-                if key in breakdown:
-                    total += float(breakdown.get(key) or 0.0)
-                    continue
-                if hasattr(self, '_som_lot_free_qty'):
-                    # LIBRE, no físico: lo asignado a pedidos/entregas no
-                    # puede volver a apartarse.
-                    total += self._som_lot_free_qty(lot)[2]
-                    continue
-                quants = self.env['stock.quant'].search([
-                    ('lot_id', '=', lot.id),
-                    ('location_id.usage', '=', 'internal'),
-                    ('quantity', '>', 0),
-                ])
-                if quants:
-                    total += sum(quants.mapped('quantity'))
-                else:
-                    total += getattr(lot, 'product_qty', 0.0) or 0.0
-            return total
-
-        if self.quant_id:
-            return self.quant_id.quantity or 0.0
+        has_breakdown = 'x_lot_breakdown_json' in self._fields
+        lots_by_line = {}
+        pending = self.env['stock.lot']
+        for line in self:
+            lots = line.lot_ids | line.lot_id
+            breakdown = (line.x_lot_breakdown_json or {}) if has_breakdown else {}
+            lots_by_line[line] = (lots, breakdown)
+            pending |= lots.filtered(lambda lot: str(lot.id) not in breakdown)
+
+        qty_by_lot = {}
+        if pending and hasattr(self, '_som_lot_free_qty'):
+            # LIBRE, no físico: lo asignado a pedidos/entregas no
+            # puede volver a apartarse. Un recordset de lotes para que el
+            # prefetch sea compartido; cada lote se evalúa una vez.
+            for lot in pending:
+                qty_by_lot[lot.id] = self._som_lot_free_qty(lot)[2]
+        elif pending:
+            qty_by_lot = self._som_internal_qty_by_lot(pending)
+            for lot in pending:
+                if lot.id not in qty_by_lot:
+                    qty_by_lot[lot.id] = getattr(lot, 'product_qty', 0.0) or 0.0
+
+        result = {}
+        for line, (lots, breakdown) in lots_by_line.items():
+            if lots:
+                # La cantidad SIEMPRE es la suma de lo seleccionado por lote.
+                # quant_id es solo un legacy del PRIMER lote: darle prioridad
+                # dejaba la cantidad igual a los m² de una sola placa arbitraria
+                # al editar la línea (el "número de la nada").
+                result[line.id] = sum(
+                    float(breakdown.get(str(lot.id)) or 0.0) if str(lot.id) in breakdown
+                    else qty_by_lot.get(lot.id, 0.0)
+                    for lot in lots
+                )
+            elif line.quant_id:
+                result[line.id] = line.quant_id.quantity or 0.0
+            else:
+                result[line.id] = 0.0
+        return result
 
-        return 0.0
+    def _get_quantity_from_lots(self):
+        self.ensure_one()
+        return self._get_quantities_from_lots()[self.id]
 
     @api.onchange('quant_id')
     def _onchange_quant_id_set_lot_product_quantity(self):
@@ -1749,12 +2259,11 @@ class StockLotHoldOrderLine(models.Model):
         if self.env.context.get('skip_hold_line_quantity_sync'):
             return
 
-        for line in self:
-            has_lot_source = bool(line.quant_id or line.lot_id or line.lot_ids)
-            if not has_lot_source:
-                continue
+        lines = self.filtered(lambda l: l.quant_id or l.lot_id or l.lot_ids)
+        quantities = lines._get_quantities_from_lots()
 
-            qty = line._get_quantity_from_lots()
+        for line in lines:
+            qty = quantities[line.id]
 
             if abs((line.cantidad_m2 or 0.0) - qty) > 0.0001:
                 line.with_context(skip_hold_line_quantity_sync=True).write({
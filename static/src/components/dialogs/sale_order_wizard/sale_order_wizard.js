@@ -200,44 +200,49 @@ export class SaleOrderWizard extends Component {
     }
     
     async loadAllProductPrices() {
+        // Una sola llamada para todo el carrito (antes una por producto).
+        let pricesByProduct = {};
+        try {
+            pricesByProduct = await this.orm.call(
+                "product.template",
+                "get_custom_prices_batch",
+                [],
+                {
+                    product_ids: this.productIds,
+                    currency_code: this.state.selectedCurrency
+                }
+            );
+        } catch (error) {
+            console.error("Error cargando precios de los productos:", error);
+            return;
+        }
+
         for (const productId of this.productIds) {
-            try {
-                const prices = await this.orm.call(
-                    "product.template",
-                    "get_custom_prices",
-                    [],
-                    {
-                        product_id: productId,
-                        currency_code: this.state.selectedCurrency
-                    }
-                );
-                
-                // Nivel elegido con las opciones ANTERIORES (si el valor actual
-                // coincidía con una de ellas). Se captura antes de pisarlas para
-                // poder re-mapear el mismo nivel en la nueva divisa.
-                const oldOptions = this.state.productPriceOptions[productId] || [];
-                const currentValue = this.state.productPrices[productId];
-                const oldLevel = (oldOptions.find(o => o.value === currentValue) || {}).level;
+            const prices = pricesByProduct[productId] || [];
+            
+            // Nivel elegido con las opciones ANTERIORES (si el valor actual
+            // coincidía con una de ellas). Se captura antes de pisarlas para
+            // poder re-mapear el mismo nivel en la nueva divisa.
+            const oldOptions = this.state.productPriceOptions[productId] || [];
+            const currentValue = this.state.productPrices[productId];
+            const oldLevel = (oldOptions.find(o => o.value === currentValue) || {}).level;
 
-                this.state.productPriceOptions[productId] = prices;
+            this.state.productPriceOptions[productId] = prices;
 
-                if (!prices.length) {
-                    continue;
-                }
+            if (!prices.length) {
+                continue;
+            }
 
-                if (currentValue === undefined || currentValue === null || isNaN(currentValue)) {
-                    // Primera carga: primer nivel visible.
-                    this.state.productPrices[productId] = prices[0].value;
-                } else if (oldOptions.length) {
-                    // Recarga por cambio de divisa: mismo nivel en la nueva divisa.
-                    // Un precio personalizado (sin nivel) no se arrastra entre
-                    // divisas: cae al primer nivel para que el campo SIEMPRE
-                    // refleje la divisa activa.
-                    const match = oldLevel ? prices.find(o => o.level === oldLevel) : null;
-                    this.state.productPrices[productId] = match ? match.value : prices[0].value;
-                }
-            } catch (error) {
-                console.error(`Error cargando precios para producto ${productId}:`, error);
+            if (currentValue === undefined || currentValue === null || isNaN(currentValue)) {
+                // Primera carga: primer nivel visible.
+                this.state.productPrices[productId] = prices[0].value;
+            } else if (oldOptions.length) {
+                // Recarga por cambio de divisa: mismo nivel en la nueva divisa.
+                // Un precio personalizado (sin nivel) no se arrastra entre
+                // divisas: cae al primer nivel para que el campo SIEMPRE
+                // refleje la divisa activa.
+                const match = oldLevel ? prices.find(o => o.level === oldLevel) : null;
+                this.state.productPrices[productId] = match ? match.value : prices[0].value;
             }
         }
     }
@@ -5,6 +5,9 @@ import { registry } from "@web/core/registry";
 import { standardFieldProps } from "@web/views/fields/standard_field_props";
 import { useService } from "@web/core/utils/hooks";
 
+// Filas por página del selector (paginación por cursor en el servidor).
+const STONE_PAGE_SIZE = 200;
+
 export class HoldStoneExpandButton extends Component {
     static template = "inventory_shopping_cart.HoldStoneExpandButton";
     static props = { ...standardFieldProps };
@@ -449,27 +452,34 @@ export class HoldStoneExpandButton extends Component {
 
 
 
-    async _loadQuants(productId, filters = {}) {
+    async _loadQuants(productId, filters = {}, cursor = false) {
         // El selector NO debe ofrecer placas comprometidas (reservadas en otra
         // SO/entrega o en otro hold activo). El filtrado vive en el servidor para
-        // reutilizar la misma lógica que valida la conversión a SO.
+        // reutilizar la misma lógica que valida la conversión a SO. Los filtros
+        // también se aplican allá y el resultado llega por páginas (cursor).
         const holdOrderId = this.getHoldOrderId();
 
         try {
             return await this.orm.call(
                 "stock.lot.hold.order.line",
-                "get_available_stone_quants",
-                [
-                    productId,
-                    holdOrderId,
-                    filters.lotName || false,
-                    filters.locationName || false,
-                ],
-                {}
+                "get_available_stone_quants_page",
+                [productId, holdOrderId],
+                {
+                    filters: {
+                        lot_name: filters.lotName || false,
+                        location_name: filters.locationName || false,
+                        bloque: filters.bloque || false,
+                        atado: filters.atado || false,
+                        alto_min: filters.altoMin || false,
+                        ancho_min: filters.anchoMin || false,
+                    },
+                    cursor,
+                    page_size: STONE_PAGE_SIZE,
+                }
             );
         } catch (error) {
             console.error("[HOLD STONE] Error obteniendo placas disponibles:", error);
-            return [];
+            return { records: [], next_cursor: false, total: 0 };
         }
     }
 
@@ -538,8 +548,20 @@ export class HoldStoneExpandButton extends Component {
             filters: {
                 lotName: "",
                 locationName: "",
+                bloque: "",
+                atado: "",
+                altoMin: "",
+                anchoMin: "",
             },
+            // Paginación por cursor: siguiente página y lotes candidatos
+            // (el servidor solo los cuenta en la primera página).
+            nextCursor: false,
+            total: 0,
             isLoading: true,
+            // Generación de la búsqueda vigente: cada cambio de filtros la
+            // incrementa y cualquier respuesta de una generación vieja
+            // (página en vuelo o búsqueda anterior) se descarta.
+            generation: 0,
         };
 
         // Precargar parcialidades ya guardadas en la línea para los lotes
@@ -596,6 +618,22 @@ export class HoldStoneExpandButton extends Component {
                             <label>Ubicación</label>
                             <input type="text" id="hs-filter-location" placeholder="Buscar ubicación..."/>
                         </div>
+                        <div class="hold-stone-filter">
+                            <label>Bloque</label>
+                            <input type="text" id="hs-filter-bloque" placeholder="Bloque..."/>
+                        </div>
+                        <div class="hold-stone-filter">
+                            <label>Atado</label>
+                            <input type="text" id="hs-filter-atado" placeholder="Atado..."/>
+                        </div>
+                        <div class="hold-stone-filter">
+                            <label>Alto mín.</label>
+                            <input type="number" id="hs-filter-alto" min="0" step="0.01"/>
+                        </div>
+                        <div class="hold-stone-filter">
+                            <label>Largo mín.</label>
+                            <input type="number" id="hs-filter-ancho" min="0" step="0.01"/>
+                        </div>
                         <div style="display:flex; gap:8px; align-items:flex-end;">
                             <button type="button" class="btn btn-outline-secondary btn-sm" id="hs-refresh">
                                 <i class="fa fa-refresh me-1"></i>
@@ -618,6 +656,7 @@ export class HoldStoneExpandButton extends Component {
                     <div class="hold-stone-popup-footer">
                         <span class="text-muted">
                             Clic sobre una fila para seleccionar o quitar una placa.
+                            <span id="hs-page-info"></span>
                         </span>
                         <div style="display:flex; gap:8px; align-items:center;">
                             <span class="hold-stone-footer-total">
@@ -642,6 +681,11 @@ export class HoldStoneExpandButton extends Component {
         const footerTotalEl = root.querySelector("#hs-footer-total");
         const filterLot = root.querySelector("#hs-filter-lot");
         const filterLocation = root.querySelector("#hs-filter-location");
+        const filterBloque = root.querySelector("#hs-filter-bloque");
+        const filterAtado = root.querySelector("#hs-filter-atado");
+        const filterAlto = root.querySelector("#hs-filter-alto");
+        const filterAncho = root.querySelector("#hs-filter-ancho");
+        const pageInfoEl = root.querySelector("#hs-page-info");
 
         const getChosenQty = (quant, lotId) => {
             const full = Number((quant.som_free_qty ?? quant.quantity) || 0);
@@ -669,7 +713,14 @@ export class HoldStoneExpandButton extends Component {
             footerTotalEl.textContent = this._formatNumber(total);
         };
 
+        const renderPageInfo = () => {
+            pageInfoEl.textContent = state.total
+                ? ` · ${state.quants.length} placas cargadas · ${state.total} lotes candidatos${state.nextCursor ? " (desplaza para ver más)" : ""}`
+                : "";
+        };
+
         const renderTable = () => {
+            renderPageInfo();
             if (!state.quants.length) {
                 body.innerHTML = `
                     <div class="hold-stone-empty">
@@ -836,9 +887,60 @@ export class HoldStoneExpandButton extends Component {
             updateTotals();
         };
 
+        const rememberSelected = (quants) => {
+            for (const quant of quants) {
+                const lotId = this._getLotIdFromQuant(quant);
+                if (lotId && state.selectedLotIds.has(lotId)) {
+                    state.selectedQuantByLot.set(lotId, quant);
+                }
+            }
+        };
+
+        // Siguiente página (cursor) al acercarse al final del listado. Se
+        // conserva el scroll: la tabla se re-renderiza con las filas nuevas.
+        const loadMore = async () => {
+            if (state.isLoading || !state.nextCursor) {
+                return;
+            }
+            const generation = state.generation;
+            state.isLoading = true;
+            const scrollTop = body.scrollTop;
+            try {
+                const page = await this._loadQuants(productId, state.filters, state.nextCursor);
+                if (generation !== state.generation) {
+                    // Los filtros cambiaron mientras cargaba: página obsoleta.
+                    return;
+                }
+                const seen = new Set(state.quants.map((quant) => quant.id));
+                const fresh = (page.records || []).filter((quant) => !seen.has(quant.id));
+                state.quants = this._sortQuantsLikeVisual(state.quants.concat(fresh));
+                state.nextCursor = page.next_cursor || false;
+                rememberSelected(fresh);
+                renderTable();
+                body.scrollTop = scrollTop;
+            } finally {
+                if (generation === state.generation) {
+                    state.isLoading = false;
+                }
+            }
+        };
+
+        body.addEventListener("scroll", () => {
+            if (body.scrollTop + body.clientHeight >= body.scrollHeight - 200) {
+                loadMore();
+            }
+        });
+
         const loadAndRender = async () => {
             state.filters.lotName = filterLot.value || "";
             state.filters.locationName = filterLocation.value || "";
+            state.filters.bloque = filterBloque.value || "";
+            state.filters.atado = filterAtado.value || "";
+            state.filters.altoMin = filterAlto.value || "";
+            state.filters.anchoMin = filterAncho.value || "";
+            const generation = ++state.generation;
+            state.isLoading = true;
+            state.nextCursor = false;
 
             body.innerHTML = `
                 <div class="hold-stone-empty">
@@ -848,18 +950,22 @@ export class HoldStoneExpandButton extends Component {
             `;
 
             try {
-                state.quants = this._sortQuantsLikeVisual(
-                    await this._loadQuants(productId, state.filters));
-
-                for (const quant of state.quants) {
-                    const lotId = this._getLotIdFromQuant(quant);
-                    if (lotId && state.selectedLotIds.has(lotId)) {
-                        state.selectedQuantByLot.set(lotId, quant);
-                    }
+                const page = await this._loadQuants(productId, state.filters);
+                if (generation !== state.generation) {
+                    // Llegó después de una búsqueda más reciente: se descarta.
+                    return;
                 }
+                state.quants = this._sortQuantsLikeVisual(page.records || []);
+                state.nextCursor = page.next_cursor || false;
+                state.total = page.total || 0;
+
+                rememberSelected(state.quants);
 
                 renderTable();
             } catch (error) {
+                if (generation !== state.generation) {
+                    return;
+                }
                 console.error("[HOLD STONE] Error cargando inventario:", error);
                 body.innerHTML = `
                     <div class="hold-stone-empty text-danger">
@@ -867,6 +973,10 @@ export class HoldStoneExpandButton extends Component {
                         Error al cargar inventario: ${this._escapeHtml(error.message || error)}
                     </div>
                 `;
+            } finally {
+                if (generation === state.generation) {
+                    state.isLoading = false;
+                }
             }
         };
 
@@ -973,8 +1083,9 @@ export class HoldStoneExpandButton extends Component {
             timeout = setTimeout(loadAndRender, 350);
         };
 
-        filterLot.addEventListener("input", debouncedLoad);
-        filterLocation.addEventListener("input", debouncedLoad);
+        for (const input of [filterLot, filterLocation, filterBloque, filterAtado, filterAlto, filterAncho]) {
+            input.addEventListener("input", debouncedLoad);
+        }
 
         await loadAndRender();
     }
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import mute_logger
+
+from odoo.addons.inventory_shopping_cart.models import product_template as product_template_module
+
+_MODULE_LOGGER = 'odoo.addons.inventory_shopping_cart.models.product_template'
+
+
+class _BanorteStubHandler(BaseHTTPRequestHandler):
+    """Scraper Banorte de mentira: responde en orden el guion del servidor
+    (status, cuerpo, retraso) y registra cada petición recibida."""
+
+    def do_GET(self):
+        server = self.server
+        server.hits.append(self.headers.get('x-api-key'))
+        status, body, delay = server.script.pop(0) if server.script else (200, {}, 0)
+        if delay:
+            time.sleep(delay)
+        payload = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente ya se fue por timeout.
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@tagged('post_install', '-at_install')
+class TestBanorteSync(TransactionCase):
+
+    OK_PAYLOAD = {
+        'tipo-cambio-compra-banorte': '$17.10',
+        'tipo-cambio-venta-banorte': '$18.25',
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _BanorteStubHandler)
+        cls.server.daemon_threads = True
+        cls.server.script = []
+        cls.server.hits = []
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.api_url = 'http://127.0.0.1:%s/' % cls.server.server_address[1]
+
+        cls.Template = cls.env['product.template']
+        cls.icp = cls.env['ir.config_parameter'].sudo()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.script = []
+        self.server.hits = []
+        self.icp.set_param('banorte.connect_timeout', 1)
+        self.icp.set_param('banorte.read_timeout', 0.3)
+        self.icp.set_param('banorte.max_attempts', 3)
+        self.icp.set_param('banorte.backoff_seconds', 2)
+        self.icp.set_param('banorte.consecutive_failures', 0)
+        # Sin esperas reales entre reintentos; se registra cada pausa.
+        self.sleep = MagicMock()
+        self.startPatcher(patch.object(
+            product_template_module, 'time_module', MagicMock(sleep=self.sleep)))
+
+    def _fetch(self):
+        return self.Template._fetch_banorte_payload(self.api_url, 'test-key')
+
+    # ------------------------------------------------------------------
+    # _fetch_banorte_payload
+    # ------------------------------------------------------------------
+
+    def test_fetch_success_first_attempt(self):
+        self.server.script = [(200, self.OK_PAYLOAD, 0)]
+        self.assertEqual(self._fetch(), self.OK_PAYLOAD)
+        self.assertEqual(self.server.hits, ['test-key'])
+        self.sleep.assert_not_called()
+
+    def test_fetch_retries_5xx_then_succeeds(self):
+        self.server.script = [(503, {}, 0), (502, {}, 0), (200, self.OK_PAYLOAD, 0)]
+        with mute_logger(_MODULE_LOGGER):
+            self.assertEqual(self._fetch(), self.OK_PAYLOAD)
+        self.assertEqual(len(self.server.hits), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        # Full jitter: cada pausa cae entre 0 y el backoff del intento.
+        for attempt, call in enumerate(self.sleep.call_args_list, start=1):
+            delay = call.args[0]
+            self.assertGreaterEqual(delay, 0.0)
+            self.assertLessEqual(delay, min(10.0, 2.0 * (2 ** (attempt - 1))))
+
+    def test_fetch_429_exhausts_attempts(self):
+        self.server.script = [(429, {}, 0)] * 3
+        with mute_logger(_MODULE_LOGGER), self.assertRaises(requests.exceptions.HTTPError):
+            self._fetch()
+        self.assertEqual(len(self.server.hits), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_fetch_4xx_fails_fast(self):
+        self.server.script = [(401, {'error': 'bad key'}, 0), (200, self.OK_PAYLOAD, 0)]
+        with self.assertRaises(requests.exceptions.HTTPError) as ctx:
+            self._fetch()
+        self.assertEqual(ctx.exception.response.status_code, 401)
+        self.assertEqual(len(self.server.hits), 1)
+        self.sleep.assert_not_called()
+
+    def test_fetch_read_timeout_is_retried(self):
+        self.server.script = [(200, self.OK_PAYLOAD, 1.0), (200, self.OK_PAYLOAD, 0)]
+        with mute_logger(_MODULE_LOGGER):
+            self.assertEqual(self._fetch(), self.OK_PAYLOAD)
+        self.assertEqual(len(self.server.hits), 2)
+        self.assertEqual(self.sleep.call_count, 1)
+
+    def test_fetch_timeout_on_every_attempt_raises(self):
+        self.icp.set_param('banorte.max_attempts', 2)
+        self.server.script = [(200, self.OK_PAYLOAD, 1.0)] * 2
+        with mute_logger(_MODULE_LOGGER), self.assertRaises(requests.exceptions.Timeout):
+            self._fetch()
+        self.assertEqual(len(self.server.hits), 2)
+
+    # ------------------------------------------------------------------
+    # Reprogramación del cron tras fallos consecutivos
+    # ------------------------------------------------------------------
+
+    def _patch_no_window(self):
+        # Sin zona horaria no hay ventana 08:00-20:00: el reintento cercano
+        # siempre es candidato y la prueba no depende de la hora real.
+        self.startPatcher(patch.object(
+            type(self.Template), '_banorte_local_tz', lambda self: None))
+
+    def test_retry_run_is_near_while_under_failure_limit(self):
+        self._patch_no_window()
+        self.icp.set_param('banorte.consecutive_failures', 2)
+        self.icp.set_param('banorte.retry_minutes', 10)
+
+        before = datetime.utcnow()
+        retry = self.Template._get_banorte_retry_run_utc()
+        self.assertTrue(retry)
+        self.assertGreaterEqual(retry, before + timedelta(minutes=8))
+        self.assertLessEqual(retry, datetime.utcnow() + timedelta(minutes=12))
+
+    def test_retry_run_falls_back_after_max_failures(self):
+        self._patch_no_window()
+        self.icp.set_param('banorte.consecutive_failures', 4)
+        self.icp.set_param('banorte.max_consecutive_failures', 3)
+        self.assertIsNone(self.Template._get_banorte_retry_run_utc())
+
+    def test_reschedule_sets_cron_nextcall(self):
+        cron = self.env.ref('inventory_shopping_cart.ir_cron_update_banorte_prices')
+        target = datetime(2030, 1, 2, 15, 30, 0)
+        self.Template._reschedule_banorte_cron_sql(next_run_utc=target)
+        cron.invalidate_recordset(['nextcall'])
+        self.assertEqual(cron.nextcall, target)
+
+    def test_failed_sync_counts_failure_and_schedules_retry(self):
+        self._patch_no_window()
+        self.icp.set_param('banorte.api_url', self.api_url)
+        self.icp.set_param('banorte.api_key', 'test-key')
+        self.icp.set_param('banorte.retry_minutes', 10)
+        self.server.script = [(500, {}, 0)] * 3
+
+        # El cron hace commit/rollback propios; en la prueba se neutralizan
+        # para quedarse dentro de la transacción del caso.
+        cr = self.env.cr
+        self.startPatcher(patch.object(cr, 'commit', lambda: None))
+        self.startPatcher(patch.object(cr, 'rollback', lambda: None))
+
+        before = datetime.utcnow()
+        with mute_logger(_MODULE_LOGGER):
+            self.assertFalse(self.Template.cron_update_banorte_rates())
+
+        self.assertEqual(len(self.server.hits), 3)
+        self.assertEqual(self.icp.get_param('banorte.consecutive_failures'), '1')
+
+        cron = self.env.ref('inventory_shopping_cart.ir_cron_update_banorte_prices')
+        cron.invalidate_recordset(['nextcall'])
+        self.assertGreaterEqual(
+            cron.nextcall, (before + timedelta(minutes=8)).replace(microsecond=0))
+        self.assertLessEqual(cron.nextcall, datetime.utcnow() + timedelta(minutes=12))
+
+    def test_successful_sync_resets_failures(self):
+        self.icp.set_param('banorte.api_url', self.api_url)
+        self.icp.set_param('banorte.api_key', 'test-key')
+        self.icp.set_param('banorte.consecutive_failures', 2)
+        # Todo el recálculo por cambio de TC va a la cola diferida del cron.
+        self.icp.set_param('som_costing.queue_inline_limit', 0)
+        self.server.script = [(200, self.OK_PAYLOAD, 0)]
+
+        cr = self.env.cr
+        self.startPatcher(patch.object(cr, 'commit', lambda: None))
+        self.startPatcher(patch.object(cr, 'rollback', lambda: None))
+        # El EUR del BCE no forma parte de esta prueba (sin red).
+        self.startPatcher(patch.object(
+            type(self.Template), '_get_eur_to_usd_rate_for_costing',
+            lambda self, allow_network=False: (1.0, 'test')))
+        self.startPatcher(patch.object(
+            type(self.env['sale.order']), '_som_refresh_banorte_rate_orders',
+            lambda self: 0))
+
+        self.assertTrue(self.Template.cron_update_banorte_rates())
+        self.assertEqual(self.icp.get_param('banorte.consecutive_failures'), '0')
+        self.assertEqual(float(self.icp.get_param('banorte.last_rate_sell')), 18.25)